@@ -86,6 +86,15 @@ def _setPosition(MirrorHandleInt mirror,list SegmentList, int nbSegments, list P
                                PTTPositions[i][0],PTTPositions[i][1],PTTPositions[i][2])
     except:
         raise
+
+def _setPositionArray(MirrorHandleInt mirror, unsigned int[::1] SegmentArray, double[:, ::1] PTTArray):
+    cdef Py_ssize_t i
+    try:
+        for i in range(SegmentArray.shape[0]):
+            SetMirrorPosition(<MirrorHandle>mirror,SegmentArray[i],
+                               PTTArray[i, 0],PTTArray[i, 1],PTTArray[i, 2])
+    except:
+        raise
         
 def _getMirrorPosition(MirrorHandleInt mirror, list SegmentList, int nbSegments):
     cdef MirrorPosition *ptrPosition
@@ -104,6 +113,24 @@ def _getMirrorPosition(MirrorHandleInt mirror, list SegmentList, int nbSegments)
         raise
     finally:
         del ptrPosition
+
+def _getMirrorPositionArray(MirrorHandleInt mirror, unsigned int[::1] SegmentArray, double[:, ::1] PTTArray,
+                            unsigned char[::1] LockedArray, unsigned char[::1] ReachableArray):
+    cdef MirrorPosition *ptrPosition
+    cdef Py_ssize_t i
+    try:
+        ptrPosition = new MirrorPosition()
+        for i in range(SegmentArray.shape[0]):
+            GetMirrorPosition(<MirrorHandle>mirror,SegmentArray[i],ptrPosition)
+            PTTArray[i, 0] = ptrPosition.z
+            PTTArray[i, 1] = ptrPosition.xgrad
+            PTTArray[i, 2] = ptrPosition.ygrad
+            LockedArray[i] = ptrPosition.locked
+            ReachableArray[i] = ptrPosition.reachable
+    except:
+        raise
+    finally:
+        del ptrPosition
         
 
 def _setModalPosition(MirrorHandleInt mirror, list CoefficientValueCouples , int nbCoefficients):
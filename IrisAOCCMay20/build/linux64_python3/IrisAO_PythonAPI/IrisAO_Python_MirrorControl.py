@@ -10,11 +10,15 @@
 # - MirrorConnect
 # - MirrorRelease
 # - SetMirrorPosition
+# - SetMirrorPositionArray
 # - GetMirrorPosition
+# - GetMirrorPositionArray
 # - SetModalPosition
 # - MirrorCommand (supported commands: MirrorInitSettings and MirrorSendSettings)
 #--------------------------------------------------------------
 
+import numpy as np
+
 import IrisAO_Python as IAOW
 
 
@@ -71,6 +75,28 @@ def SetMirrorPosition(mirror, Segments, PTT):
             IAOW._setPosition(mirror,Segments,len(Segments),PTT)
         except:
             raise
+
+def SetMirrorPositionArray(mirror, Segments, PTT):
+    """Function SetMirrorPositionArray
+    Arguments:
+    - mirror: mirror handle (int)
+    - Segments : array of N segment numbers
+    - PTT: (N, 3) array of (z, xgrad, ygrad), one row for each
+           segment in 'Segments'
+    The arrays are handed to the wrapper through the buffer protocol,
+    no python object is created per segment if they already are
+    contiguous uintc and float64 arrays"""
+    Segments = np.ascontiguousarray(Segments, dtype=np.uintc).reshape(-1)
+    PTT = np.ascontiguousarray(PTT, dtype=np.float64).reshape(-1, 3)
+    if Segments.shape[0] != PTT.shape[0]:
+        raise ValueError("'Segments' and 'PTT' should have the same length")
+    try:
+        if hasattr(IAOW, '_setPositionArray'):
+            IAOW._setPositionArray(mirror,Segments,PTT)
+        else: # wrapper compiled without the array functions
+            IAOW._setPosition(mirror,Segments.tolist(),Segments.shape[0],PTT.tolist())
+    except:
+        raise
         
 def GetMirrorPosition(mirror,Segments):
     """Function GetMirrorPosition
@@ -101,6 +127,35 @@ def GetMirrorPosition(mirror,Segments):
             return (PTT, locked, reachable) 
     except:
         raise
+
+def GetMirrorPositionArray(mirror, Segments, PTT, locked, reachable):
+    """Function GetMirrorPositionArray
+    Arguments:
+    - mirror: mirror handle (int)
+    - Segments : array of N segment numbers
+    - PTT: (N, 3) C-contiguous float64 array, filled in place with
+       the (z, xgrad, ygrad) of each segment in 'Segments'
+    - locked: (N,) bool array, filled in place
+    - reachable: (N,) bool array, filled in place
+    Return: tuple (PTT, locked, reachable), the arrays given as input
+    """
+    Segments = np.ascontiguousarray(Segments, dtype=np.uintc).reshape(-1)
+    nbSegments = Segments.shape[0]
+    if PTT.shape != (nbSegments, 3) or locked.shape != (nbSegments,) \
+            or reachable.shape != (nbSegments,):
+        raise ValueError("'PTT', 'locked' and 'reachable' should have shapes (N, 3), (N,) and (N,)")
+    try:
+        if hasattr(IAOW, '_getMirrorPositionArray'):
+            IAOW._getMirrorPositionArray(mirror,Segments,PTT,
+                                         locked.view(np.uint8),reachable.view(np.uint8))
+        else: # wrapper compiled without the array functions
+            PTTList, lockedList, reachableList = IAOW._getMirrorPosition(mirror,Segments.tolist(),nbSegments)
+            PTT[:] = PTTList
+            locked[:] = lockedList
+            reachable[:] = reachableList
+        return (PTT, locked, reachable)
+    except:
+        raise
   
 def SetModalPosition(mirror,CoefficientValueCouples):
     """Function SetModalPosition
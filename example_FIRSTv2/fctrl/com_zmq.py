@@ -9,7 +9,11 @@
 
 
 import time
+import json
+import struct
 import zmq
+import numpy as np
+from queue import Queue
 from threading import Thread
 
 
@@ -52,27 +56,108 @@ class PColors:
 
 
 ################################################################################
-##################             Subscriber class             ####################
+##################             Command protocol             ####################
 ################################################################################
 
 
-"""
-
-   Pubsub envelope subscriber
+# A command is a multipart message [address, header, payload...]
+#   * address: the topic, filtered by the subscriber socket itself
+#   * header: CMD_HEADER, i.e. opcode, segment selector, axes, nb of segments
+#   * payload, depending on the opcode:
+#       OP_SET_POS: [segments as uint16 (n,), if SEL_LIST]
+#                   positions as float64 (n, nb of axes), C-ordered
+#       OP_CALL: json {"command": name, "kwargs": {...}}
+# The positions are sent raw, so that set_pos can be streamed at high rate
+
+
+CMD_HEADER = struct.Struct('<BBBH')  # opcode, selector, axes, nb of segments
+
+OP_CALL = 0
+OP_SET_POS = 1
+
+SEL_LIST = 0
+SEL_ALL = 1
+SEL_FIRST = 2
+SELECTORS = {'all': SEL_ALL, 'first': SEL_FIRST}
+
+AXES = ('piston', 'tip', 'tilt')
+
+
+def encode_call(address, command, **kwargs):
+    """
+    Returns the frames of a call to the command, with keyword arguments
+    """
+    kwargs = {k: (v.tolist() if hasattr(v, 'tolist') else v) for k, v in kwargs.items()}
+    return [address, CMD_HEADER.pack(OP_CALL, 0, 0, 0),
+            json.dumps({'command': command, 'kwargs': kwargs}).encode('UTF-8')]
+
+
+def encode_set_pos(address, elm, piston=None, tip=None, tilt=None):
+    """
+    Returns the frames of a set_pos command
+
+    elm can be an int, a list of int, 'first' or 'all'; the positions
+    left to None remain unchanged
+    """
+    values = [(i, v) for i, v in enumerate((piston, tip, tilt)) if v is not None]
+    axes = sum(1 << i for i, v in values)
+    pos = np.empty((0, len(values)))
+    if values:
+        pos = np.column_stack([np.atleast_1d(np.asarray(v, dtype=np.float64)) for i, v in values])
+    if isinstance(elm, str):
+        return [address, CMD_HEADER.pack(OP_SET_POS, SELECTORS[elm.lower()], axes, pos.shape[0]),
+                np.ascontiguousarray(pos)]
+    seg = np.atleast_1d(np.asarray(elm, dtype=np.uint16))
+    # the mems sorts the segments
+    order = np.argsort(seg)
+    if values:
+        pos = pos[order]
+    return [address, CMD_HEADER.pack(OP_SET_POS, SEL_LIST, axes, seg.size),
+            np.ascontiguousarray(seg[order]), np.ascontiguousarray(pos)]
+
+
+def decode_command(frames):
+    """
+    Returns the command name and keyword arguments from the frames
+    received (address included), without copying the positions
+    """
+    opcode, selector, axes, n = CMD_HEADER.unpack(frames[1])
+    if opcode == OP_CALL:
+        cmd = json.loads(bytes(frames[2]).decode('UTF-8'))
+        return cmd['command'], cmd['kwargs']
+    elif opcode == OP_SET_POS:
+        if selector == SEL_LIST:
+            elm = np.frombuffer(frames[2], dtype=np.uint16, count=n).tolist()
+            payload = frames[3]
+        else:
+            elm = 'all' if selector == SEL_ALL else 'first'
+            payload = frames[2]
+        kwargs = {'elm': elm}
+        iaxes = [i for i in range(3) if axes & (1 << i)]
+        if iaxes:
+            pos = np.frombuffer(payload, dtype=np.float64).reshape(n, len(iaxes))
+            for col, i in enumerate(iaxes):
+                kwargs[AXES[i]] = pos[:, col]
+        return 'set_pos', kwargs
+    raise ValueError("Unknown opcode: {}".format(opcode))
 
-   Author: Guillaume Aubert (gaubert) <guillaume(dot)aubert(at)gmail(dot)com>
 
-"""
+################################################################################
+##################             Subscriber class             ####################
+################################################################################
 
 
 class ComPortSUB(Thread):
-    def __init__(self, publisher, port_SUB, address):
+    # Receives the commands sent to address, and runs them from the
+    # dispatch table commands, a dict {command name: function}
+    def __init__(self, publisher, port_SUB, address, commands):
         Thread.__init__(self)
         self.running = False
 
         self.pub = publisher
         self.port = port_SUB
         self.address = address
+        self.commands = commands
 
         self.start()
 
@@ -87,10 +172,14 @@ class ComPortSUB(Thread):
         self._creation_socket()
         self.running = True
         while self.running:
-            [address_cmd, command] = self.sub.recv_multipart()
+            frames = self.sub.recv_multipart(copy=False)
             try:
-                self.pub.pprint("try com sub")
-                exec(command)
+                command, kwargs = decode_command([frame.buffer for frame in frames])
+                func = self.commands.get(command)
+                if func is None:
+                    self.pub.pprint("Unknown command: %s" % (command))
+                else:
+                    func(**kwargs)
             except Exception as cur_exception:
                 self.pub.pprint(MyException(cur_exception))
 
@@ -110,21 +199,75 @@ class ComPortSUB(Thread):
 
 
 class ComPortPUB(object):
-    def __init__(self, port_PUB, client_adress):
+    # The messages are queued by pprint and sent by a background thread, so
+    # that printing never blocks the caller. The subscriber needs some time
+    # to connect and subscribe after the bind ("slow joiner"): the sender
+    # thread waits for it only once, before sending the first message.
+    def __init__(self, port_PUB, client_address, join_timeout=1., join_delay=0.1):
         self.port = port_PUB
-        self.adress = client_adress
+        self.address = client_address
+        self.join_timeout = join_timeout  # max time waiting for a subscriber (s)
+        self.join_delay = join_delay  # time left to the subscription once connected (s)
 
         self.context = zmq.Context()
         self.pub = self.context.socket(zmq.PUB)
+        self.monitor = self.pub.get_monitor_socket(zmq.EVENT_ACCEPTED)
         self.pub.bind(self.port)
+
+        self.queue = Queue()
+        self.sender = Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
         self.pprint("\n\nCom transmitter is initialized (address: %s)" % (self.port))
 
+    def _wait_subscriber(self):
+        # One-time slow joiner handshake
+        if self.monitor.poll(self.join_timeout * 1000):
+            time.sleep(self.join_delay)
+        self.pub.disable_monitor()
+        self.monitor.close()
+
+    def _send_loop(self):
+        self._wait_subscriber()
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            self.pub.send_multipart([self.address, message])
+
     def pprint(self, message):
-        time.sleep(1)  # need time to sleep before sending a message
-        self.pub.send_multipart([self.adress, str(message).encode('UTF-8')])
+        self.queue.put(str(message).encode('UTF-8'))
 
     def stop(self):
         self.pprint("Com transmitter is closed (address: %s)" % (self.port))
         self.pprint("done()")
-        self.pub.close()
+        # sends what is left in the queue before closing
+        self.queue.put(None)
+        self.sender.join()
+        self.pub.close(linger=1000)
+        self.context.term()
+
+
+################################################################################
+##################             Commander class              ####################
+################################################################################
+
+
+class ComPortCMD(object):
+    # Client side: sends commands to the ComPortSUB listening on port_PUB
+    def __init__(self, port_PUB, server_address):
+        self.port = port_PUB
+        self.address = server_address
+
+        self.context = zmq.Context()
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.bind(self.port)
+
+    def call(self, command, **kwargs):
+        self.pub.send_multipart(encode_call(self.address, command, **kwargs))
+
+    def set_pos(self, elm, piston=None, tip=None, tilt=None):
+        self.pub.send_multipart(encode_set_pos(self.address, elm, piston, tip, tilt), copy=False)
+
+    def stop(self):
+        self.pub.close(linger=1000)
         self.context.term()
@@ -45,20 +45,24 @@ except:
 
 import os
 import glob
+import json
+import hashlib
 import numpy as np
 from datetime import datetime
 
 from patiencebar import Patiencebar
 from scipy.ndimage import gaussian_filter
 
-try:
-    import IrisAO_PythonAPI as IrisAO_API
-except:
-    print("skipping IrisAO")
-
-
 from param import *
 
+if MEMSSIMULATED:
+    import memsSim as IrisAO_API
+else:
+    try:
+        import IrisAO_PythonAPI as IrisAO_API
+    except:
+        print("skipping IrisAO")
+
 
 def concat_dir(*args):
     """
@@ -95,6 +99,11 @@ PATHCONFIGFILE = home_dir(*PATHCONFIGFILE)
 PATHCALMEMS = home_dir(*PATHCALMEMS)
 PATHIMG = home_dir(*PATHIMG)
 
+# first bytes of the shape files (npz archive)
+NPZMAGIC = b'PK\x03\x04'
+# shapes already loaded, by file name
+_SHAPES = {}
+
 
 def clean_txt(txt):
     """
@@ -125,6 +134,18 @@ def clean_pos(arr, ax):
         return tuple(arr.tolist())
 
 
+def clip_pos(arr, ax):
+    """
+    Same as clean_pos, but returns the clipped positions as a 1D
+    ndarray, ready for IrisAO_API.SetMirrorPositionArray
+    """
+    if ax.lower() == 'tiptilt':
+        minmax = [TIPTILTMIN, TIPTILTMAX]
+    else:
+        minmax = [PISTONMIN, PISTONMAX]
+    return np.clip(np.atleast_1d(np.asarray(arr, dtype=float)), minmax[0], minmax[1])
+
+
 def mask_elm(elm):
     """
     Always give cleaned elm as input
@@ -132,6 +153,82 @@ def mask_elm(elm):
     return np.asarray(elm)-1
 
 
+def compute_radii(map_index, map_centers):
+    """
+    Computes the x and y distances of each pixel of the index map to
+    the center of its segment. Pixels out of the segments are set to 1
+    """
+    map_index = np.asarray(map_index)
+    map_radius_x = np.ones(map_index.shape)
+    map_radius_y = np.ones(map_index.shape)
+    pix_x, pix_y = np.nonzero(map_index)
+    seg = map_index[pix_x, pix_y].astype(np.intp) - 1
+    map_radius_x[pix_x, pix_y] = pix_x - map_centers[0, seg]
+    map_radius_y[pix_x, pix_y] = pix_y - map_centers[1, seg]
+    return map_radius_x, map_radius_y
+
+
+def load_radii(map_index, map_centers, index_path, centers_path, cache_path):
+    """
+    Returns the radius maps computed by ``compute_radii``, reusing the
+    ones cached in ``cache_path`` if the index and centers files have
+    not changed since they were computed
+    """
+    sha = hashlib.sha1()
+    for path in (index_path, centers_path):
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    key = sha.hexdigest()
+    if os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cache:
+                if str(cache['key']) == key:
+                    return cache['radius_x'], cache['radius_y']
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+    map_radius_x, map_radius_y = compute_radii(map_index, map_centers)
+    try:
+        np.savez(cache_path, key=key, radius_x=map_radius_x, radius_y=map_radius_y)
+    except (IOError, OSError):
+        pass
+    return map_radius_x, map_radius_y
+
+
+def opd_lookup(map_index, map_radius_x, map_radius_y):
+    """
+    Precomputes the flat pixel -> segment lookup used by ``update_opd``,
+    so that the index map is only scanned once
+    """
+    pix = np.flatnonzero(map_index)
+    seg = np.asarray(map_index).ravel()[pix].astype(np.intp) - 1
+    return {'pix': pix,
+            'seg': seg,
+            'rx': np.asarray(map_radius_x, dtype=np.float32).ravel()[pix],
+            'ry': np.asarray(map_radius_y, dtype=np.float32).ravel()[pix],
+            'val': np.empty(pix.size, dtype=np.float32),
+            'tmp': np.empty(pix.size, dtype=np.float32)}
+
+
+def update_opd(map_opd, lookup, piston, tip, tilt):
+    """
+    Computes in place the opd map of all segments from their piston,
+    tip and tilt (in mrad). ``map_opd`` should be a C-contiguous
+    float32 array and ``lookup`` the output of ``opd_lookup``
+    """
+    seg = lookup['seg']
+    val = lookup['val']
+    tmp = lookup['tmp']
+    np.take(np.asarray(piston, dtype=np.float32), seg, out=val, mode='clip')
+    np.take(np.sin(np.asarray(tip, dtype=np.float32) * 1e-3), seg, out=tmp, mode='clip')
+    tmp *= lookup['rx']
+    val += tmp
+    np.take(np.sin(np.asarray(tilt, dtype=np.float32) * 1e-3), seg, out=tmp, mode='clip')
+    tmp *= lookup['ry']
+    val += tmp
+    np.put(map_opd, lookup['pix'], val)
+    return map_opd
+
+
 def gauss2D(x, y, a=1., x0=0., y0=0., sigma=1., foot=0.):
     Y, X = np.meshgrid(x, y)
     return gaussPt(x=X, y=Y, a=a, x0=x0, y0=y0, sigma=sigma, foot=foot)
@@ -168,3 +265,45 @@ def list_filepath(fmt):
     names = glob.glob(os.path.join(PATHCONFIGFILE, pattern))
     names = [os.path.split(os.path.splitext(item)[0])[1] for item in names]
     return sorted(names, key=lambda x: x.rsplit('_', 1)[-1])
+
+
+def save_shape(name, arr):
+    """
+    Saves a (NSEGMENTS, 3) shape as a npz archive: the positions in
+    'pos', and the json metadata (mirror serial, number of segments,
+    position limits and date) as a string in 'meta'
+    """
+    meta = {'mirror': MIRRORNUM,
+            'nsegments': NSEGMENTS,
+            'limits': [PISTONMIN, PISTONMAX, TIPTILTMIN, TIPTILTMAX],
+            'date': datetime.utcnow().strftime('%Y%m%dT%H%M%S-%f')}
+    with open(name, 'wb') as f:
+        np.savez(f, pos=np.ascontiguousarray(arr, dtype=float), meta=json.dumps(meta))
+
+
+def load_shape(name):
+    """
+    Loads a shape file, npz or legacy text, and returns the
+    (NSEGMENTS, 3) read-only positions and the metadata dict (empty
+    for text files)
+
+    The shapes already loaded are kept in memory, and read again only
+    if their file changed. They are not memory-mapped: numpy cannot map
+    the arrays of a npz archive, and a shape is only NSEGMENTS*3 floats
+    """
+    stat = os.stat(name)
+    key = (stat.st_mtime, stat.st_size)
+    if name in _SHAPES and _SHAPES[name][0] == key:
+        return _SHAPES[name][1:]
+    with open(name, 'rb') as f:
+        magic = f.read(len(NPZMAGIC))
+    if magic == NPZMAGIC:
+        with np.load(name) as data:
+            pos = data['pos']
+            meta = json.loads(data['meta'].item())
+    else:
+        pos = np.loadtxt(name)
+        meta = {}
+    pos.flags.writeable = False
+    _SHAPES[name] = (key, pos, meta)
+    return pos, meta
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  FIRSTCTRL - Pupil remapping control software
+#  Copyright (C) 2016  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+################################################################################
+##################            Mems hot-path benchmark       ####################
+################################################################################
+
+
+# Measures the mems command and opd rendering hot paths against the simulated
+# mirror (memsSim), whatever MEMSSIMULATED is set to in param.py.
+#
+# usage: python memsBench.py [--nrep 2000] [--json results.json]
+#
+# For each benchmark, reports the calls per second, the median and 99th
+# percentile latency, and the memory allocated during one call (tracemalloc
+# peak). The json output can be kept to compare the results between releases.
+
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime
+
+import core
+np = core.np
+
+# The benchmarks always run on the simulated mirror
+import memsSim
+core.MEMSSIMULATED = True
+core.IrisAO_API = memsSim
+
+from memsCtrl import Mems, FCTRLV2_PATH, MEMS_INDEX_NAME, MEMS_CENTERS_NAME
+from _version import __version__
+
+
+################################################################################
+##################           Function definition            ####################
+################################################################################
+
+
+class _Publisher(object):
+    # Swallows the messages of the Mems
+    def pprint(self, message):
+        pass
+
+
+def hex_geometry(nrings, seg_px=20):
+    """
+    Index map and centers of a hexagonal segmented mirror, with nrings
+    rings of segments around the central one (3 -> 37, 7 -> 169 segments)
+    """
+    centers = []
+    for r in range(-nrings, nrings + 1):
+        for q in range(-nrings, nrings + 1):
+            if abs(q + r) <= nrings:
+                centers.append((seg_px * (q + r / 2.), seg_px * np.sqrt(3) / 2. * r))
+    centers = np.array(centers).T
+    size = int(np.ceil((2 * nrings + 1) * seg_px)) + 2
+    centers = np.round(centers + size / 2.).astype(int)
+    pix_x, pix_y = np.indices((size, size))
+    dist = (pix_x[..., None] - centers[0])**2 + (pix_y[..., None] - centers[1])**2
+    map_index = dist.argmin(axis=-1) + 1
+    map_index[dist.min(axis=-1) > (0.45 * seg_px)**2] = 0
+    return map_index, centers
+
+
+def run_bench(func, nrep):
+    """
+    Times nrep calls of func, then measures the memory allocated by
+    one call
+    """
+    func()
+    times = np.empty(nrep)
+    for i in range(nrep):
+        t0 = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - t0
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    alloc = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return {'calls_per_s': nrep / times.sum(),
+            'p50_us': np.percentile(times, 50) * 1e6,
+            'p99_us': np.percentile(times, 99) * 1e6,
+            'alloc_bytes': int(alloc)}
+
+
+def command_benches(nrep):
+    """
+    Benchmarks of the Mems commands
+    """
+    m = Mems(_Publisher(), milk_solution=False)
+    nfirst = len(core.FIRSTSEGS)
+    values = np.linspace(-1, 1, core.NSEGMENTS)
+    out = np.empty((core.NSEGMENTS, 3))
+    benches = [
+        ('clip_pos', lambda: core.clip_pos(values, ax='tiptilt')),
+        ('set_pos_single', lambda: m.set_pos(1, 0.1, 0.2, 0.3)),
+        ('set_pos_first', lambda: m.set_pos('first', values[:nfirst], values[:nfirst], values[:nfirst])),
+        ('set_pos_all', lambda: m.set_pos('all', values, values, values)),
+        ('get_pos_all', lambda: m.get_pos('all')),
+        ('get_pos_all_out', lambda: m.get_pos('all', out=out)),
+        ('readback', m.readback),
+        ('set_modal', lambda: m.set_modal(values[:core.MEMSNMODES])),
+    ]
+    res = {}
+    for name, func in benches:
+        res[name] = run_bench(func, nrep)
+    m.disconnect()
+    return res
+
+
+def render_benches(nrep):
+    """
+    Benchmarks of the opd map rendering, for the 37 and 169 segments
+    geometries
+    """
+    geometries = [('hex37', hex_geometry(3)), ('hex169', hex_geometry(7))]
+    try:
+        from astropy.io import fits
+        map_index = fits.getdata(FCTRLV2_PATH + MEMS_INDEX_NAME)
+        map_centers = np.loadtxt(FCTRLV2_PATH + MEMS_CENTERS_NAME, dtype=int)
+        geometries.insert(0, ('mems_index', (map_index, map_centers)))
+    except (ImportError, IOError, OSError):
+        pass
+    res = {}
+    for name, (map_index, map_centers) in geometries:
+        nseg = map_centers.shape[1]
+        map_radius_x, map_radius_y = core.compute_radii(map_index, map_centers)
+        lookup = core.opd_lookup(map_index, map_radius_x, map_radius_y)
+        map_opd = np.zeros(np.shape(map_index), dtype=np.float32)
+        piston, tip, tilt = np.random.uniform(-1, 1, (3, nseg))
+        res['render_' + name] = run_bench(lambda: core.update_opd(map_opd, lookup, piston, tip, tilt), nrep)
+        res['render_' + name]['shape'] = list(np.shape(map_index))
+        res['render_' + name]['nsegments'] = nseg
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the mems hot paths on the simulated mirror")
+    parser.add_argument('--nrep', type=int, default=2000, help="number of calls per benchmark")
+    parser.add_argument('--json', default=None, help="file where to save the results")
+    args = parser.parse_args(argv)
+
+    results = {}
+    results.update(command_benches(args.nrep))
+    results.update(render_benches(args.nrep))
+
+    print("{:<22s}{:>12s}{:>10s}{:>10s}{:>12s}".format('benchmark', 'calls/s', 'p50 us', 'p99 us', 'alloc B'))
+    for name, res in results.items():
+        print("{:<22s}{:>12.0f}{:>10.1f}{:>10.1f}{:>12d}".format(name, res['calls_per_s'], res['p50_us'],
+                                                                res['p99_us'], res['alloc_bytes']))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'version': __version__,
+                       'date': datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'nrep': args.nrep,
+                       'results': results}, f, indent=2)
+        print("Saved in '{}'".format(args.json))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -25,13 +25,15 @@
 ###############################################################################
 
 import time
-from threading import Thread
+from threading import Thread, Condition, Lock
 from astropy.io import fits
 from pyMilk.interfacing.isio_shmlib import SHM
 
 from com_zmq import PColors
 
 import core
+import memsModal
+import memsTrajectory
 os = core.os
 np = core.np
 glob = core.glob
@@ -47,6 +49,9 @@ FCTRLV2_PATH = os.getcwd() + "/"
 MEMS_INDEX_NAME = "mems_index.fits"
 MEMS_OPD_NAME = "mems_opd.fits"
 MEMS_CENTERS_NAME = "mems_centers.txt"
+MEMS_RADII_NAME = "mems_radii.npz"
+MEMS_MODAL_NAME = "mems_modal.npz"
+MEMS_MODAL_PINV_NAME = "mems_modal_pinv.npz"
 
 
 ################################################################################
@@ -58,7 +63,7 @@ __all__ = ['Mems']
 
 
 class Mems(Thread):
-    def __init__(self, publisher):
+    def __init__(self, publisher, milk_solution=True):
         super().__init__()
 
         # Define the attributes
@@ -71,7 +76,39 @@ class Mems(Thread):
 
         self.pub = publisher
         self.running = True
-        self.milk_solution = True
+        self.milk_solution = milk_solution
+
+        # Wakes up the rendering thread when _pos changes
+        self._pos_cond = Condition()
+        self._pos_seq = 0
+        # copy of the positions being rendered
+        self._render_pos = np.zeros((core.NSEGMENTS, 3))
+
+        # Smooth transitions, streamed by a thread started on first use
+        self._player = None
+        self._send_lock = Lock()
+
+        # Preallocated buffers for the positions read from the mems
+        self._all_seg = np.arange(1, core.NSEGMENTS + 1, dtype=np.uintc)
+        self._locked = np.zeros(core.NSEGMENTS, dtype=bool)
+        self._reachable = np.zeros(core.NSEGMENTS, dtype=bool)
+        self._hist_time = np.zeros(core.MEMSHISTORYSIZE)
+        self._hist_pos = np.zeros((core.MEMSHISTORYSIZE, core.NSEGMENTS, 3))
+        self._hist_locked = np.zeros((core.MEMSHISTORYSIZE, core.NSEGMENTS), dtype=bool)
+        self._hist_reachable = np.zeros((core.MEMSHISTORYSIZE, core.NSEGMENTS), dtype=bool)
+        self._hist_modes = np.zeros((core.MEMSHISTORYSIZE, core.MEMSNMODES))
+        self._hist_count = 0
+        # guards the history ring, filled by readback and the rendering thread
+        self._hist_lock = Lock()
+
+        # Zernike -> (piston, tip, tilt) matrix and its inverse, loaded on first use
+        self._modal_matrix = None
+        self._modal_pinv = None
+        # why the modal matrix could not be loaded, if so
+        self._modal_error = None
+        self._modal_pos = np.empty(core.NSEGMENTS * 3)
+        self._modes = np.zeros(core.MEMSNMODES)
+        self._modes_data = np.zeros((core.MEMSNMODES, 1), dtype=np.float32)
 
         if self.milk_solution:
             # Prepare the maps to be ploted
@@ -80,6 +117,7 @@ class Mems(Thread):
 
             # Prepare the shared memory
             self.data_plot = SHM('irisaoim', ((self.map_width, self.map_height), np.float32), location=-1, shared=True)
+            self.modes_plot = SHM('irisaomodes', ((core.MEMSNMODES, 1), np.float32), location=-1, shared=True)
 
             # Start the mems
             self.start()
@@ -113,15 +151,31 @@ class Mems(Thread):
         # Push the initial opd map
         self._init_figure()
 
+        # Load the modal matrix before the rendering thread needs it
+        self._fill_modes(self._pos, self._modes)
+
         # Start the Thread
         super().start()
 
     def stop(self):
         self._pprint("    Closing mems...\n")
+        if self._player is not None:
+            self._player.stop()
         time.sleep(1)
-        self.running = False
-        time.sleep(1)
-        self.join()
+        with self._pos_cond:
+            self.running = False
+            self._pos_cond.notify_all()
+        # not started without milk_solution
+        if self.is_alive():
+            self.join()
+
+    def _pos_changed(self):
+        """
+        Notifies the rendering thread that the positions have changed
+        """
+        with self._pos_cond:
+            self._pos_seq += 1
+            self._pos_cond.notify_all()
 
     def connect(self):
         """
@@ -131,7 +185,8 @@ class Mems(Thread):
         if self._connected:
             return 0
         # hack to CD to the folder with the cal files
-        os.chdir(core.PATHCALMEMS)
+        if not core.MEMSSIMULATED:
+            os.chdir(core.PATHCALMEMS)
         disableHardware = False
         self._mirror = IrisAO_API.MirrorConnect(core.MIRRORNUM,
                                                 core.DRIVERNUM,
@@ -147,9 +202,13 @@ class Mems(Thread):
         if not self._connected:
             self._pprint("ERROR: Not connected to Mems")
             return 0
+        self._cancel_trajectory()
         self.flat()
-        IrisAO_API.MirrorRelease(self._mirror)
-        self._connected = False
+        # a trajectory step being sent goes first
+        with self._send_lock:
+            IrisAO_API.MirrorRelease(self._mirror)
+            self._connected = False
+        self._pos_changed()
 
     def exit(self):
         """
@@ -194,29 +253,120 @@ class Mems(Thread):
         if not self._connected:
             self._pprint("ERROR: Not connected to Mems")
             return 0
-        IrisAO_API.MirrorCommand(self._mirror,
-                                 IrisAO_API.MirrorInitSettings)
-        self._pos = np.zeros((core.NSEGMENTS, 3))
-
-    def _moveit(self, arr, elm):
+        self._cancel_trajectory()
+        # a trajectory step being sent goes first
+        with self._send_lock:
+            IrisAO_API.MirrorCommand(self._mirror,
+                                     IrisAO_API.MirrorInitSettings)
+            self._pos = np.zeros((core.NSEGMENTS, 3))
+        self._pos_changed()
+
+    def _moveit(self, arr, elm, duration=None, profile=None, wait=False):
         elm, sz = self._clean_segment(elm)
         if elm is None:
             self._pprint("Wrong input, should be int, list of int, 'first', or 'all'")
             return 0
-        piston, tip, tilt = arr[:, :][core.mask_elm(elm)].T
-        self.set_pos(elm=elm, piston=piston, tip=tip, tilt=tilt)
+        return self.move(elm, arr[core.mask_elm(elm)], duration=duration,
+                         profile=profile, wait=wait)
 
-    def off(self, elm='all'):
+    def off(self, elm='all', duration=None, profile=None, wait=False):
         """
         Sets all piston to nil; sets tip & tilt to min range
+
+        See move for the transition arguments
         """
-        self._moveit(self._off, elm)
+        return self._moveit(self._off, elm, duration=duration, profile=profile, wait=wait)
 
-    def on(self, elm='first'):
+    def on(self, elm='first', duration=None, profile=None, wait=False):
         """
         Sets all piston to nil; sets tip & tilt to min range
+
+        See move for the transition arguments
         """
-        self._moveit(self._on, elm)
+        return self._moveit(self._on, elm, duration=duration, profile=profile, wait=wait)
+
+    def move(self, elm, pos, duration=None, profile=None, wait=False):
+        """
+        Moves the segments to the positions through a smooth transition,
+        streamed to the mems in the background. Returns the Trajectory,
+        or None if the segments were set at once
+
+        A new command (move, set_pos, flat...) stops the transition
+        where it is
+
+        Args:
+          * elm: the segments, as for set_pos
+          * pos (array): (N, 3) piston, tip, tilt of the N segments
+          * duration (float or None): of the transition in s, defaults
+            to MEMSTRANSITIONTIME; 0 sets the positions at once
+          * profile (str or None): 'linear', 'cosine' or 'minjerk',
+            defaults to MEMSTRANSITIONPROFILE
+          * wait (bool): blocks until the transition is done
+        """
+        if not self._connected:
+            self._pprint("ERROR: Not connected to Mems")
+            return
+        elm, sz = self._clean_segment(elm)
+        if elm is None:
+            self._pprint("Wrong input, should be int, list of int, 'first', or 'all'")
+            return
+        pos = np.asarray(pos, dtype=float)
+        if pos.shape != (sz, 3):
+            self._pprint('Wrong size, should be ({}, 3)'.format(sz))
+            return
+        if duration is None:
+            duration = core.MEMSTRANSITIONTIME
+        if profile is None:
+            profile = core.MEMSTRANSITIONPROFILE
+        if profile not in memsTrajectory.PROFILES:
+            self._pprint("Profile should be one of {}".format(sorted(memsTrajectory.PROFILES)))
+            return
+        if duration <= 0:
+            self.set_pos(elm=elm, piston=pos[:, 0], tip=pos[:, 1], tilt=pos[:, 2])
+            return
+        end = np.column_stack((core.clip_pos(pos[:, 0], ax='piston'),
+                               core.clip_pos(pos[:, 1], ax='tiptilt'),
+                               core.clip_pos(pos[:, 2], ax='tiptilt')))
+        nsteps = max(int(round(duration * core.MEMSTRAJRATE)), 1)
+        self._cancel_trajectory()
+        with self._send_lock:
+            start = self._pos[core.mask_elm(elm)]
+        positions = memsTrajectory.make_trajectory(start, end, nsteps, kind=profile)
+        return self._play(memsTrajectory.Trajectory(elm, positions, duration / nsteps), wait)
+
+    def _play(self, trajectory, wait):
+        if self._player is None or not self._player.is_alive():
+            self._player = memsTrajectory.TrajectoryPlayer(self._send_trajectory,
+                                                           report=self._pprint)
+            self._player.start()
+        self._player.play(trajectory)
+        if wait:
+            trajectory.wait()
+        return trajectory
+
+    def _cancel_trajectory(self):
+        """
+        Stops the transition being played, if any
+        """
+        if self._player is not None:
+            self._player.cancel()
+
+    def _send_pos(self, elm, new_val):
+        """
+        Sends the (N, 3) positions of the segments elm to the mems
+        """
+        # replace in local values
+        self._pos[core.mask_elm(elm), :] = new_val
+        IrisAO_API.SetMirrorPositionArray(self._mirror, elm, new_val)
+        IrisAO_API.MirrorCommand(self._mirror, IrisAO_API.MirrorSendSettings)
+        self._pos_changed()
+
+    def _send_trajectory(self, trajectory, new_val):
+        # a command given meanwhile wins over the step
+        with self._send_lock:
+            if trajectory.cancelled or not self._connected:
+                return
+            self._send_pos(trajectory.elm, new_val)
 
     def _clean_segment(self, elm):
         if isinstance(elm, int):
@@ -232,7 +382,7 @@ class Mems(Thread):
             return None, None
         return elm, len(elm)
 
-    def get_pos(self, elm):
+    def get_pos(self, elm, out=None):
         """
         Gets the positions of the mems segments
 
@@ -243,6 +393,10 @@ class Mems(Thread):
           * list of int -> n segment
           * 'first' -> the first segments
           * 'all' -> all segments
+
+        out can be a (n, 3) float64 C-contiguous array to be filled in
+        place instead of allocating a new one. The positions returned
+        are then a view of out
         """
         if not self._connected:
             self._pprint("ERROR: Not connected to Mems")
@@ -251,9 +405,70 @@ class Mems(Thread):
         if elm is None:
             self._pprint("Wrong input, should be int, list of int, 'first', or 'all'")
             return 0
-        # (tip, tilt, piston), locked, reachable
-        return np.asarray(IrisAO_API.\
-                  GetMirrorPosition(self._mirror, elm)[0]).T
+        if out is None:
+            out = np.empty((sz, 3))
+            locked = np.empty(sz, dtype=bool)
+            reachable = np.empty(sz, dtype=bool)
+        else:
+            # scratch buffers, the flags are not returned
+            locked = self._locked[:sz]
+            reachable = self._reachable[:sz]
+        # (piston, tip, tilt), locked, reachable
+        IrisAO_API.GetMirrorPositionArray(self._mirror, elm, out, locked, reachable)
+        return out.T
+
+    def _readback(self):
+        """
+        Reads the positions of all segments from the mems into the next
+        slot of the history ring, without allocating any array, and
+        returns the index of that slot. The caller holds _hist_lock
+        """
+        idx = self._hist_count % core.MEMSHISTORYSIZE
+        IrisAO_API.GetMirrorPositionArray(self._mirror, self._all_seg, self._hist_pos[idx],
+                                          self._hist_locked[idx], self._hist_reachable[idx])
+        self._hist_time[idx] = time.time()
+        self._fill_modes(self._hist_pos[idx], self._hist_modes[idx])
+        self._hist_count += 1
+        return idx
+
+    def readback(self):
+        """
+        Reads the positions of all segments from the mems into the next
+        slot of the history ring
+
+        Returns copies of the positions (NSEGMENTS, 3), locked and
+        reachable flags of that slot, that the rendering thread may
+        overwrite later. The modal coefficients of the positions are
+        kept in the slot too, see modal_history
+        """
+        if not self._connected:
+            self._pprint("ERROR: Not connected to Mems")
+            return None
+        with self._hist_lock:
+            idx = self._readback()
+            return self._hist_pos[idx].copy(), self._hist_locked[idx].copy(), self._hist_reachable[idx].copy()
+
+    def history(self):
+        """
+        Returns the positions read back by readback, from the oldest to
+        the most recent, as a tuple (times, positions, locked, reachable)
+        """
+        with self._hist_lock:
+            n = min(self._hist_count, core.MEMSHISTORYSIZE)
+            order = np.arange(self._hist_count - n, self._hist_count) % core.MEMSHISTORYSIZE
+            return (self._hist_time[order], self._hist_pos[order],
+                    self._hist_locked[order], self._hist_reachable[order])
+
+    def modal_history(self):
+        """
+        Returns the modal coefficients of the positions read back by
+        readback, from the oldest to the most recent, as a tuple (times,
+        coefficients)
+        """
+        with self._hist_lock:
+            n = min(self._hist_count, core.MEMSHISTORYSIZE)
+            order = np.arange(self._hist_count - n, self._hist_count) % core.MEMSHISTORYSIZE
+            return self._hist_time[order], self._hist_modes[order]
 
     def set_pos(self, elm, piston=None, tip=None, tilt=None):
         """
@@ -272,6 +487,7 @@ class Mems(Thread):
         if not self._connected:
             self._pprint("ERROR: Not connected to Mems")
             return
+        self._cancel_trajectory()
         elm, sz = self._clean_segment(elm)
         # check input
 
@@ -280,29 +496,129 @@ class Mems(Thread):
         elif np.size(piston) != sz:
             self._pprint('Wrong size, should be same as elm: {}'.format(sz))
             return
-        piston = core.clean_pos(piston, ax='piston')
+        piston = core.clip_pos(piston, ax='piston')
 
         if tip is None:
             tip = self._pos[:, 1][core.mask_elm(elm)]
         elif np.size(tip) != sz:
             self._pprint('Wrong size, should be same as elm: {}'.format(sz))
             return
-        tip = core.clean_pos(tip, ax='tiptilt')
+        tip = core.clip_pos(tip, ax='tiptilt')
         
         if tilt is None:
             tilt = self._pos[:, 2][core.mask_elm(elm)]
         elif np.size(tilt) != sz:
             self._pprint('Wrong size, should be same as elm: {}'.format(sz))
             return
-        tilt = core.clean_pos(tilt, ax='tiptilt')
+        tilt = core.clip_pos(tilt, ax='tiptilt')
         
-        new_val = np.vstack((piston, tip, tilt)).T
-        self._pos[core.mask_elm(elm), :] = new_val
-        new_val = [tuple(item) for item in new_val]
-        # print(new_val)
-        # replace in local values
-        IrisAO_API.SetMirrorPosition(self._mirror, elm, new_val)
-        IrisAO_API.MirrorCommand(self._mirror, IrisAO_API.MirrorSendSettings)
+        new_val = np.column_stack((piston, tip, tilt))
+        with self._send_lock:
+            self._send_pos(elm, new_val)
+
+    @property
+    def modal_matrix(self):
+        """
+        The (NSEGMENTS*3, MEMSNMODES) matrix giving the positions of the
+        segments from the modal coefficients, see memsModal
+        """
+        if self._modal_matrix is None:
+            self._modal_matrix = memsModal.load_modal_matrix(
+                                    FCTRLV2_PATH + MEMS_CENTERS_NAME,
+                                    core.MEMSNMODES,
+                                    FCTRLV2_PATH + MEMS_MODAL_NAME,
+                                    mcf_path=os.path.join(core.PATHCALMEMS, core.MIRRORNUM + '.mcf'))
+        return self._modal_matrix
+
+    @modal_matrix.setter
+    def modal_matrix(self, value):
+        self._pprint('Read-only')
+
+    @property
+    def modal_pinv(self):
+        """
+        The (MEMSNMODES, NSEGMENTS*3) least-squares inverse of
+        modal_matrix, see memsModal
+        """
+        if self._modal_pinv is None:
+            self._modal_pinv = memsModal.load_modal_pinv(self.modal_matrix,
+                                                         FCTRLV2_PATH + MEMS_MODAL_PINV_NAME)
+        return self._modal_pinv
+
+    @modal_pinv.setter
+    def modal_pinv(self, value):
+        self._pprint('Read-only')
+
+    def get_modal(self, pos=None, out=None):
+        """
+        Returns the coefficients of the modes that best fit the
+        positions of the segments
+
+        Args:
+          * pos (array or None): (NSEGMENTS, 3) piston, tip and tilt,
+            the last positions sent if None
+          * out (array or None): (MEMSNMODES,) float64 array to fill in
+            place instead of allocating a new one
+        """
+        if pos is None:
+            pos = self._pos
+        if self.modal_pinv.shape[1] != np.size(pos):
+            # the modal matrix is not made for this mirror
+            if out is None:
+                self._pprint("The modal matrix is made for {} segments".format(self.modal_pinv.shape[1] // 3))
+                return None
+            out[:] = np.nan
+            return out
+        return memsModal.zonal_to_modal(self.modal_pinv, pos, out=out)
+
+    def _fill_modes(self, pos, out):
+        """
+        Fills out with the modal coefficients of the positions, or with
+        nan if the modal matrix cannot be loaded. The error is reported
+        once, and does not stop the rendering thread
+        """
+        if self._modal_error is None:
+            try:
+                return self.get_modal(pos, out=out)
+            except Exception as e:
+                self._modal_error = e
+                self._pprint("ERROR: Cannot load the modal matrix, the modes are not published: {}".format(e))
+        out[:] = np.nan
+        return out
+
+    def modal_to_zonal(self, coefs):
+        """
+        Returns the (NSEGMENTS, 3) piston, tip and tilt that make the
+        modal coefficients, without moving the mems
+
+        Args:
+          * coefs (list of float or of couples): the coefficients of the
+            first modes, or (coefficient number, value) couples as for
+            IrisAO_API.SetModalPosition
+        """
+        return memsModal.modal_to_zonal(self.modal_matrix, coefs)
+
+    def set_modal(self, coefs):
+        """
+        Sets all segments to the sum of the modes given, in one command
+
+        Args:
+          * coefs (list of float or of couples): the coefficients of the
+            first modes, or (coefficient number, value) couples as for
+            IrisAO_API.SetModalPosition
+        """
+        if not self._connected:
+            self._pprint("ERROR: Not connected to Mems")
+            return
+        if self.modal_matrix.shape[0] != core.NSEGMENTS * 3:
+            self._pprint("The modal matrix is made for {} segments".format(self.modal_matrix.shape[0] // 3))
+            return
+        try:
+            ptt = memsModal.modal_to_zonal(self.modal_matrix, coefs, out=self._modal_pos)
+        except (ValueError, IndexError) as e:
+            self._pprint("Wrong coefficients: {}".format(e))
+            return
+        self.set_pos('all', piston=ptt[:, 0], tip=ptt[:, 1], tilt=ptt[:, 2])
 
     def _shape_save(self, name, arr, override):
         if not self._connected:
@@ -311,7 +627,7 @@ class Mems(Thread):
         if os.path.isfile(name) and not bool(override):
             self._pprint("File '{}' already exists".format(name))
             return
-        np.savetxt(name, arr, header="PISTON, TIP, TILT")
+        core.save_shape(name, arr)
         self._pprint("Saved in '{}'".format(name))
 
     def shape_save(self, name, override=False):
@@ -413,24 +729,31 @@ class Mems(Thread):
             self._pprint("ERROR: Not connected to Mems")
             return None
         if os.path.isfile(name):
-            l = np.loadtxt(name)
+            pos, meta = core.load_shape(name)
+            if np.shape(pos) != (core.NSEGMENTS, 3):
+                self._pprint("File '{}' holds a shape of {} segments instead of {}".format(name,
+                        len(pos), core.NSEGMENTS))
+                return None
+            if meta.get('mirror', core.MIRRORNUM) != core.MIRRORNUM:
+                self._pprint("Warning: '{}' was saved for the mirror {}".format(name, meta['mirror']))
             self._pprint("Loaded '{}'".format(name))
-            return l
+            return pos.copy()
         else:
             self._pprint("File '{}' not found".format(name))
             return None
 
-    def shape_load(self, name):
+    def shape_load(self, name, duration=None, profile=None, wait=False):
         """
         Loads a shape file previously saved
 
         Args:
           * name (str): the name of the file
+          * duration, profile, wait: the transition, see move
         """
         name = core.make_filepath_nostamp(name, core.SHAPEFILENAME)
         res = self._shape_load(name)
         if res is not None:
-            self._moveit(np.loadtxt(name), 'all')
+            return self._moveit(res, 'all', duration=duration, profile=profile, wait=wait)
 
     def shape_on_load(self, name):
         """
@@ -442,7 +765,7 @@ class Mems(Thread):
         name = core.make_filepath_nostamp(name, core.SHAPEONFILENAME)
         res = self._shape_load(name)
         if res is not None:
-            self._on = np.loadtxt(name)
+            self._on = res
 
     def shape_off_load(self, name):
         """
@@ -454,75 +777,115 @@ class Mems(Thread):
         name = core.make_filepath_nostamp(name, core.SHAPEOFFFILENAME)
         res = self._shape_load(name)
         if res is not None:
-            self._off = np.loadtxt(name)
+            self._off = res
 
     ##### Seb & Nick's additions - Might be broke #########
-    def piston_scan(self, elm, piston_begin, piston_end, step, wait_time):
+    def piston_scan(self, elm, piston_begin, piston_end, step, wait_time, wait=True):
         """
         Piston Scan function. Format is piston_scan(Seg#, Where to begin, Where to end, stepsize,wait time).
-        It will then scan through once. 
+        It will then scan through once, every step, in the background
+        if wait is False, and returns the Trajectory. 
         """
+        if not self._connected:
+            self._pprint("ERROR: Not connected to Mems")
+            return
+        elm, sz = self._clean_segment(elm)
+        if elm is None:
+            self._pprint("Wrong input, should be int, list of int, 'first', or 'all'")
+            return
         nb_steps=int((abs(piston_end)+abs(piston_begin))/step)
-        # print(nb_steps)
-        # print('Initiating ramp from '+str(piston_begin)+' to '+str(piston_end)+' with '+str(nb_steps)+' steps')
         self._pprint("MEMS Scanning....")
-        for i in range(0, nb_steps+1):
-            self.set_pos(elm, piston_begin+i*step, 0, 0)
-            # print(piston_begin+i*step)
-            # print('Piston step nb '+str(i+1))
-            time.sleep(wait_time)
+        positions = np.zeros((nb_steps+1, sz, 3))
+        positions[:, :, 0] = core.clip_pos(piston_begin+np.arange(nb_steps+1)*step, ax='piston')[:, None]
+        self._cancel_trajectory()
+        return self._play(memsTrajectory.Trajectory(elm, positions, wait_time, skip_late=False), wait)
 
     # Gui methods
     def run(self):
-        if self.milk_solution:
-            while self.running:
-                if self.connected:
-                    # Get pos of mems
-                    piston, tip, tilt = self.get_pos('all')
-                    if self.flag_test:
-                        self.flag_test = False
-                        np.savetxt(FCTRLV2_PATH + "pisttiptilt_test.txt",
-                                   np.concatenate((np.array(piston), np.array(tip), np.array(tilt))).reshape((3, 37)))
-
-                    # Compute the new opd map
-                    self._update_map(piston, tip, tilt)
-
-                    # Push data to the sahred memory
-                    self.data_plot.set_data(self.map_opd.astype(np.float32))
-                else:
+        """
+        Refreshes the opd shared memory each time the positions are
+        changed, at most MEMSPUBMAXRATE times per second. The positions
+        are also read back from the mems every MEMSREADBACKPERIOD seconds
+        """
+        if not self.milk_solution:
+            return
+        min_period = 1. / core.MEMSPUBMAXRATE if core.MEMSPUBMAXRATE > 0 else 0.
+        readback_period = core.MEMSREADBACKPERIOD if core.MEMSREADBACKPERIOD > 0 else None
+        last_seq = None
+        last_readback = 0.
+        while self.running:
+            with self._pos_cond:
+                if self._pos_seq == last_seq and self.running:
+                    self._pos_cond.wait(readback_period)
+                seq = self._pos_seq
+            # _pos_changed is called with _send_lock held, so it is not
+            # taken inside _pos_cond
+            with self._send_lock:
+                self._render_pos[:] = self._pos
+            if not self.running:
+                break
+            t0 = time.time()
+            if not self.connected:
+                if seq != last_seq:
                     self._init_figure()
+                last_seq = seq
+                continue
+            if readback_period is not None and t0 - last_readback >= readback_period:
+                # Get pos of mems, and their modes
+                with self._hist_lock:
+                    idx = self._readback()
+                    self._render_pos[:] = self._hist_pos[idx]
+                    self._modes[:] = self._hist_modes[idx]
+                piston, tip, tilt = self._render_pos.T
+                last_readback = t0
+            elif seq != last_seq:
+                piston, tip, tilt = self._render_pos.T
+                self._fill_modes(self._render_pos, self._modes)
+            else:
+                continue
+            last_seq = seq
+            if self.flag_test:
+                self.flag_test = False
+                np.savetxt(FCTRLV2_PATH + "pisttiptilt_test.txt",
+                           np.concatenate((np.array(piston), np.array(tip), np.array(tilt))).reshape((3, 37)))
+
+            # Compute the new opd map
+            self._update_map(piston, tip, tilt)
+
+            # Push data to the sahred memory
+            self.data_plot.set_data(self.map_opd)
+            self._modes_data[:, 0] = self._modes
+            self.modes_plot.set_data(self._modes_data)
+
+            # Throttle the refresh rate
+            dt = min_period - (time.time() - t0)
+            if dt > 0:
+                time.sleep(dt)
 
     def _compute_radii(self):
-        for pix_x in range(self.map_height):
-            for pix_y in range(self.map_width):
-                seg_ind = self.map_index[pix_x, pix_y]
-                if seg_ind != 0:
-                    radius_x = pix_x - self.map_centers[0, seg_ind - 1]
-                    self.map_radius_x[pix_x, pix_y] = radius_x
-                    radius_y = pix_y - self.map_centers[1, seg_ind - 1]
-                    self.map_radius_y[pix_x, pix_y] = radius_y
+        self.map_radius_x, self.map_radius_y = core.load_radii(self.map_index, self.map_centers,
+                                                               FCTRLV2_PATH + MEMS_INDEX_NAME,
+                                                               FCTRLV2_PATH + MEMS_CENTERS_NAME,
+                                                               FCTRLV2_PATH + MEMS_RADII_NAME)
 
     def _init_maps(self):
         self.map_index, self.map_index_h = fits.getdata(FCTRLV2_PATH + MEMS_INDEX_NAME, header=True)
         self.map_height, self.map_width = np.shape(self.map_index)
-        self.map_opd = np.ones((self.map_height, self.map_width))
+        self.map_opd = np.ones((self.map_height, self.map_width), dtype=np.float32)
         self.map_opd[self.map_index == 0] = 0
         self.map_centers = np.loadtxt(FCTRLV2_PATH + MEMS_CENTERS_NAME, dtype=np.int)
-        self.map_radius_x = np.ones((self.map_height, self.map_width))
-        self.map_radius_y = np.ones((self.map_height, self.map_width))
         self._compute_radii()
+        # flat pixel -> segment lookup, built once
+        self._map_lookup = core.opd_lookup(self.map_index, self.map_radius_x, self.map_radius_y)
 
     def _init_figure(self):
-        self.data_plot.set_data(self.map_opd.astype(np.float32))
+        self.data_plot.set_data(self.map_opd)
 
     def _update_map(self, piston_arr, tip_arr, tilt_ar):
         """
         Compute piston, tip and tilt in opd unit.
         """
-        for seg_ind in range(37):
-            tip_value = self.map_radius_x[self.map_index == seg_ind + 1] * np.sin(tip_arr[seg_ind] * 10 ** (-3))
-            tilt_value = self.map_radius_y[self.map_index == seg_ind + 1] * np.sin(tilt_ar[seg_ind] * 10 ** (-3))
-            self.map_opd[self.map_index == seg_ind + 1] = piston_arr[seg_ind] + tip_value + tilt_value
+        core.update_opd(self.map_opd, self._map_lookup, piston_arr, tip_arr, tilt_ar)
 
 
 '''
@@ -59,6 +59,7 @@ FCTRLV2_PATH = os.getcwd() + "/"
 MEMS_INDEX_NAME = "mems_index.fits"
 MEMS_OPD_NAME = "mems_opd.fits"
 MEMS_CENTERS_NAME = "mems_centers.txt"
+MEMS_RADII_NAME = "mems_radii.npz"
 
 # ACTIVE_MEMS_SEGS = [22, 11, 27, 20, 2, 5, 36, 17, 31]
 ACTIVE_MEMS_SEGS = np.array([37, 9, 24, 35, 7, 4, 33, 15, 28])  # new mapp, 15_11_2019
@@ -100,12 +101,11 @@ class MemsDynamicMplCanvas(MyMplCanvas):
         # Initialise the different maps for the display of the mems surface
         self.map_index, self.map_index_h = fits.getdata(FCTRLV2_PATH + MEMS_INDEX_NAME, header=True)
         self.map_height, self.map_width = np.shape(self.map_index)
-        self.map_opd = np.ones((self.map_height, self.map_width))
+        self.map_opd = np.ones((self.map_height, self.map_width), dtype=np.float32)
         self.map_opd[self.map_index == 0] = 0
         self.map_centers = np.loadtxt(FCTRLV2_PATH + MEMS_CENTERS_NAME, dtype=np.int)
-        self.map_radius_x = np.ones((self.map_height, self.map_width))
-        self.map_radius_y = np.ones((self.map_height, self.map_width))
         self.compute_radii()
+        self.map_lookup = core.opd_lookup(self.map_index, self.map_radius_x, self.map_radius_y)
 
         # Initialise the figure (canvas)
         MyMplCanvas.__init__(self, *args, **kwargs)
@@ -132,24 +132,17 @@ class MemsDynamicMplCanvas(MyMplCanvas):
 
     def imshow_pist_tiptilt(self, piston_arr, tip_arr, tilt_ar):
         # Compute piston, tip and tilt in the opd map
-        for seg_ind in range(37):
-            tip_value = self.map_radius_x[self.map_index == seg_ind + 1] * np.sin(tip_arr[seg_ind] * 10 ** (-3))
-            tilt_value = self.map_radius_y[self.map_index == seg_ind + 1] * np.sin(tilt_ar[seg_ind] * 10 ** (-3))
-            self.map_opd[self.map_index == seg_ind + 1] = piston_arr[seg_ind] + tip_value + tilt_value
+        core.update_opd(self.map_opd, self.map_lookup, piston_arr, tip_arr, tilt_ar)
 
         self.axes.clear()
         self.axes.imshow(self.map_opd, interpolation='nearest', aspect='auto', origin='lower', cmap='jet')
         self.draw()
 
     def compute_radii(self):
-        for pix_x in range(self.map_height):
-            for pix_y in range(self.map_width):
-                seg_ind = self.map_index[pix_x, pix_y]
-                if seg_ind != 0:
-                    radius_x = pix_x - self.map_centers[0, seg_ind - 1]
-                    self.map_radius_x[pix_x, pix_y] = radius_x
-                    radius_y = pix_y - self.map_centers[1, seg_ind - 1]
-                    self.map_radius_y[pix_x, pix_y] = radius_y
+        self.map_radius_x, self.map_radius_y = core.load_radii(self.map_index, self.map_centers,
+                                                               FCTRLV2_PATH + MEMS_INDEX_NAME,
+                                                               FCTRLV2_PATH + MEMS_CENTERS_NAME,
+                                                               FCTRLV2_PATH + MEMS_RADII_NAME)
 
 
 class MemsWindow(QtWidgets.QMainWindow):
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  FIRSTCTRL - Pupil remapping control software
+#  Copyright (C) 2016  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+################################################################################
+##################        Modal to zonal projection         ####################
+################################################################################
+
+
+# Computes locally the (piston, tip, tilt) of all segments that make a sum of
+# Zernike modes, as one matrix-vector product, instead of sending the modal
+# coefficients to the driver one (coefficient, value) couple at a time. The
+# other way, the modal coefficients of the positions of the segments come from
+# a precomputed least-squares inverse of the same matrix.
+#
+# The modes are numbered as the coefficients of SetModalPosition and the [MV]
+# entries of the .mcf files: ANSI order, from 0 (piston), normalized to 1 rms
+# over the pupil. The coefficients are in the piston units (um), the tip and
+# tilt come out in mrad. Tip is the slope along the first axis of the index
+# map (first row of mems_centers.txt), tilt along the second, as drawn by
+# core.update_opd.
+
+
+import os
+import hashlib
+from math import factorial
+
+import numpy as np
+
+from param import MEMSSEGPITCH
+
+
+__all__ = ['ansi_nm', 'zernike', 'modal_matrix', 'mcf_modal_matrix',
+           'load_modal_matrix', 'hex_centers', 'modal_to_zonal', 'modal_pinv',
+           'load_modal_pinv', 'zonal_to_modal']
+
+
+################################################################################
+##################           Function definition            ####################
+################################################################################
+
+
+def ansi_nm(j):
+    """
+    Returns the radial and azimuthal orders (n, m) of the ANSI mode j
+    """
+    n = int(np.ceil((-3 + np.sqrt(9 + 8 * j)) / 2))
+    return n, 2 * j - n * (n + 2)
+
+
+def zernike(j, x, y):
+    """
+    Evaluates the ANSI mode j, normalized to 1 rms over the unit disk,
+    at the points (x, y) in units of the pupil radius
+    """
+    n, m = ansi_nm(j)
+    rho = np.hypot(x, y)
+    theta = np.arctan2(y, x)
+    radial = np.zeros(np.shape(rho))
+    for k in range((n - abs(m)) // 2 + 1):
+        radial += (-1)**k * factorial(n - k) \
+                  / (factorial(k) * factorial((n + abs(m)) // 2 - k) * factorial((n - abs(m)) // 2 - k)) \
+                  * rho**(n - 2 * k)
+    if m == 0:
+        return np.sqrt(n + 1) * radial
+    elif m > 0:
+        return np.sqrt(2 * (n + 1)) * radial * np.cos(m * theta)
+    else:
+        return np.sqrt(2 * (n + 1)) * radial * np.sin(-m * theta)
+
+
+def _pitch(centers):
+    """
+    Distance between two neighbour segments, in the units of centers
+    """
+    dist = np.hypot(*(centers[:, :, None] - centers[:, None, :]))
+    dist[np.diag_indices_from(dist)] = np.inf
+    return np.median(dist.min(axis=1))
+
+
+def modal_matrix(centers, nmodes, pitch=MEMSSEGPITCH, nsamples=15):
+    """
+    Computes the (NSEGMENTS*3, nmodes) matrix that gives the (piston,
+    tip, tilt) of the segments, flattened segment by segment, from the
+    modal coefficients
+
+    Each mode is fitted with a plane in the least-squares sense over a
+    disk sampled inside each segment, as wide as the segment pitch
+
+    Args:
+      * centers (array): (2, NSEGMENTS) centers of the segments, in any
+        unit (e.g. the pixels of mems_centers.txt)
+      * nmodes (int): the number of modes
+      * pitch (float): distance between two neighbour segments, in mm
+      * nsamples (int): number of samples across a segment
+    """
+    centers = np.asarray(centers, dtype=float)
+    # in mm, from the center of the mirror
+    centers = (centers - centers.mean(axis=1)[:, None]) * pitch / _pitch(centers)
+    radius = np.hypot(*centers).max() + pitch / 2.
+    # samples in a disk of the segment, and their plane fit
+    offsets = np.linspace(-pitch / 2., pitch / 2., int(nsamples))
+    dx, dy = [item.ravel() for item in np.meshgrid(offsets, offsets, indexing='ij')]
+    inside = np.hypot(dx, dy) <= pitch / 2.
+    dx, dy = dx[inside], dy[inside]
+    fit = np.linalg.pinv(np.column_stack((np.ones(dx.size), dx, dy)))
+    x = (centers[0][:, None] + dx) / radius
+    y = (centers[1][:, None] + dy) / radius
+    res = np.empty((centers.shape[1], 3, int(nmodes)))
+    for j in range(int(nmodes)):
+        # (NSEGMENTS, 3) from (NSEGMENTS, nsamples)
+        res[:, :, j] = np.dot(zernike(j, x, y), fit.T)
+    # slopes in um/mm, i.e. mrad
+    return res.reshape(-1, int(nmodes))
+
+
+def mcf_modal_matrix(path, nmodes=None):
+    """
+    Reads the modal matrix of the driver from the [MV] entries of a .mcf
+    file, in the same layout as modal_matrix. nmodes defaults to the
+    [MS] entry
+    """
+    vectors = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('[MS:') and nmodes is None:
+                nmodes = int(line.strip()[4:-1])
+            elif line.startswith('[MV:'):
+                items = line.strip()[4:-1].split(',')
+                vectors[(int(items[0]), int(items[1]))] = [float(item) for item in items[2:5]]
+    if len(vectors) == 0:
+        raise ValueError("No modal vectors in '{}'".format(path))
+    nseg = max(key[0] for key in vectors)
+    if nmodes is None:
+        nmodes = max(key[1] for key in vectors) + 1
+    res = np.zeros((nseg, 3, int(nmodes)))
+    for (seg, j), ptt in vectors.items():
+        if j < nmodes:
+            res[seg - 1, :, j] = ptt
+    return res.reshape(-1, int(nmodes))
+
+
+def load_modal_matrix(centers_path, nmodes, cache_path, mcf_path=None, pitch=MEMSSEGPITCH):
+    """
+    Returns the modal matrix of the mirror, reusing the one cached in
+    cache_path if the geometry has not changed since it was computed
+
+    The matrix is read from the .mcf file if mcf_path is given and
+    exists, else computed by modal_matrix from the centers file
+    """
+    use_mcf = mcf_path is not None and os.path.isfile(mcf_path)
+    source = mcf_path if use_mcf else centers_path
+    sha = hashlib.sha1()
+    with open(source, 'rb') as f:
+        sha.update(f.read())
+    sha.update(repr((int(nmodes), float(pitch), use_mcf)).encode())
+    key = sha.hexdigest()
+    if os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cache:
+                if str(cache['key']) == key:
+                    return cache['matrix']
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+    if use_mcf:
+        matrix = mcf_modal_matrix(mcf_path, nmodes)
+    else:
+        matrix = modal_matrix(np.loadtxt(centers_path), nmodes, pitch=pitch)
+    try:
+        np.savez(cache_path, key=key, matrix=matrix)
+    except (IOError, OSError):
+        pass
+    return matrix
+
+
+def hex_centers(nseg, pitch=1.):
+    """
+    Centers (2, nseg) of a hexagonal mirror, ring after ring from the
+    central segment
+    """
+    centers = [(0., 0.)]
+    ring = 1
+    directions = [(np.cos(np.pi / 3 * k + np.pi / 2), np.sin(np.pi / 3 * k + np.pi / 2))
+                  for k in range(7)]
+    while len(centers) < nseg:
+        for k in range(6):
+            start = np.multiply(directions[k], ring)
+            step = np.subtract(directions[k + 1], directions[k])
+            for i in range(ring):
+                centers.append(tuple(start + i * step))
+        ring += 1
+    return np.array(centers[:nseg]).T * pitch
+
+
+def modal_to_zonal(matrix, coefs, out=None):
+    """
+    Returns the (NSEGMENTS, 3) piston, tip and tilt that make the modal
+    coefficients
+
+    Args:
+      * matrix (array): the modal matrix
+      * coefs (array or list of couples): the coefficients of the first
+        modes, or (coefficient number, value) couples as taken by
+        SetModalPosition
+      * out (array or None): (NSEGMENTS*3,) array to fill in place
+    """
+    nmodes = matrix.shape[1]
+    if isinstance(coefs, tuple):
+        coefs = [coefs]
+    if len(coefs) > 0 and np.ndim(coefs[0]) == 1:
+        vector = np.zeros(nmodes)
+        for coef, value in coefs:
+            vector[int(coef)] = value
+        coefs = vector
+    coefs = np.asarray(coefs, dtype=float).ravel()
+    if coefs.size > nmodes:
+        raise ValueError("Only {} modes available".format(nmodes))
+    elif coefs.size < nmodes:
+        # a slice of the matrix would be copied by np.dot
+        coefs = np.concatenate((coefs, np.zeros(nmodes - coefs.size)))
+    return np.dot(matrix, coefs, out=out).reshape(-1, 3)
+
+
+def modal_pinv(matrix, pitch=MEMSSEGPITCH, rcond=1e-6):
+    """
+    Computes the (nmodes, NSEGMENTS*3) least-squares inverse of the
+    modal matrix, that gives the modal coefficients of the positions of
+    the segments
+
+    The tip and tilt are weighted by the rms opd they make over a
+    segment, so that the fit minimizes the opd residuals
+    """
+    weights = np.tile([1., pitch / 4., pitch / 4.], matrix.shape[0] // 3)
+    return np.linalg.pinv(matrix * weights[:, None], rcond=rcond) * weights
+
+
+def load_modal_pinv(matrix, cache_path, pitch=MEMSSEGPITCH):
+    """
+    Returns the inverse of the modal matrix computed by modal_pinv,
+    reusing the one cached in cache_path if the matrix has not changed
+    since it was computed
+    """
+    sha = hashlib.sha1(np.ascontiguousarray(matrix, dtype=float).tobytes())
+    sha.update(repr(float(pitch)).encode())
+    key = sha.hexdigest()
+    if os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path) as cache:
+                if str(cache['key']) == key:
+                    return cache['pinv']
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+    pinv = modal_pinv(matrix, pitch=pitch)
+    try:
+        np.savez(cache_path, key=key, pinv=pinv)
+    except (IOError, OSError):
+        pass
+    return pinv
+
+
+def zonal_to_modal(pinv, pos, out=None):
+    """
+    Returns the modal coefficients of the (NSEGMENTS, 3) piston, tip
+    and tilt of the segments
+
+    Args:
+      * pinv (array): the inverse of the modal matrix
+      * pos (array): the positions of the segments
+      * out (array or None): (nmodes,) array to fill in place
+    """
+    return np.dot(pinv, np.ravel(pos), out=out)
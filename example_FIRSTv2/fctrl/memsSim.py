@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  FIRSTCTRL - Pupil remapping control software
+#  Copyright (C) 2016  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+################################################################################
+##################          Simulated IrisAO mirror         ####################
+################################################################################
+
+
+# Drop-in replacement of the IrisAO_PythonAPI module, that simulates the mirror
+# in software. It needs neither the hardware, nor the compiled IrisAO_Python
+# extension, nor the calibration files. It is used instead of IrisAO_PythonAPI
+# when MEMSSIMULATED is True in param.py
+
+
+import time
+from threading import Lock
+
+import numpy as np
+
+from param import MEMSSIMLATENCY, MEMSSIMLOCKED, MEMSNMODES
+import memsModal
+
+
+################################################################################
+##################             Global variables             ####################
+################################################################################
+
+
+# Number of segments, from the prefix of the mirror name
+NSEGMENTS_PREFIX = {'FSC37': 37, 'PTT111': 37, 'PTT489': 163, 'PWA163': 169}
+NSEGMENTS_DEFAULT = 37
+
+# Mechanical range of the segments
+PISTONSTROKE = 5.  # same units as the piston given to the mems
+TIPTILTSTROKE = 8.  # same units as the tip and tilt given to the mems
+
+MirrorSendSettings = 1
+MirrorInitSettings = 2
+
+_mirrors = {}
+_lock = Lock()
+
+
+################################################################################
+##################           Function definition            ####################
+################################################################################
+
+
+def _nsegments(mirror):
+    for prefix, nseg in NSEGMENTS_PREFIX.items():
+        if str(mirror).startswith(prefix):
+            return nseg
+    return NSEGMENTS_DEFAULT
+
+
+def _get(mirror):
+    try:
+        return _mirrors[mirror]
+    except KeyError:
+        raise RuntimeError("Invalid mirror handle: {}".format(mirror))
+
+
+def _index(state, Segments):
+    idx = np.asarray(Segments, dtype=int).reshape(-1) - 1
+    if idx.size > 0 and (idx.min() < 0 or idx.max() >= state['nseg']):
+        raise RuntimeError("Invalid segment number, should be in 1..{}".format(state['nseg']))
+    return idx
+
+
+def _wait():
+    # every driver access takes MEMSSIMLATENCY
+    if MEMSSIMLATENCY > 0:
+        time.sleep(MEMSSIMLATENCY)
+
+
+def MirrorConnect(mirror, driver, HWdisabled):
+    """
+    Creates a simulated mirror and returns its handle (int)
+    """
+    _wait()
+    nseg = _nsegments(mirror)
+    locked = np.zeros(nseg, dtype=bool)
+    locked[[seg - 1 for seg in MEMSSIMLOCKED if 0 < seg <= nseg]] = True
+    with _lock:
+        handle = max(_mirrors) + 1 if _mirrors else 1
+        _mirrors[handle] = {'nseg': nseg,
+                            'lock': Lock(),
+                            'command': np.zeros((nseg, 3)),
+                            'position': np.zeros((nseg, 3)),
+                            'locked': locked,
+                            'reachable': np.ones(nseg, dtype=bool),
+                            'modal': np.zeros(MEMSNMODES),
+                            'modal_matrix': None}
+    return handle
+
+
+def MirrorRelease(mirror):
+    """
+    Releases a simulated mirror, returns 0
+    """
+    _wait()
+    with _lock:
+        _get(mirror)
+        del _mirrors[mirror]
+    return 0
+
+
+def SetMirrorPosition(mirror, Segments, PTT):
+    """
+    Stages the (z, xgrad, ygrad) positions of one segment, or of a list
+    of segments. They are applied on MirrorSendSettings
+    """
+    if isinstance(Segments, int):
+        Segments, PTT = [Segments], [PTT]
+    SetMirrorPositionArray(mirror, Segments, PTT)
+
+
+def SetMirrorPositionArray(mirror, Segments, PTT):
+    """
+    Same as SetMirrorPosition, with an array of N segment numbers and
+    an (N, 3) array of positions
+    """
+    state = _get(mirror)
+    idx = _index(state, Segments)
+    PTT = np.asarray(PTT, dtype=float).reshape(-1, 3)
+    if idx.size != PTT.shape[0]:
+        raise ValueError("'Segments' and 'PTT' should have the same length")
+    _wait()
+    with state['lock']:
+        state['command'][idx] = PTT
+
+
+def GetMirrorPosition(mirror, Segments):
+    """
+    Returns the tuple (PTT, locked, reachable) of one segment, or of
+    a list of segments, as IrisAO_PythonAPI.GetMirrorPosition
+    """
+    one = isinstance(Segments, int)
+    seg = [Segments] if one else Segments
+    n = len(seg)
+    PTT, locked, reachable = GetMirrorPositionArray(mirror, seg, np.empty((n, 3)),
+                                                    np.empty(n, dtype=bool),
+                                                    np.empty(n, dtype=bool))
+    PTT = [tuple(item) for item in PTT.tolist()]
+    locked = locked.tolist()
+    reachable = reachable.tolist()
+    if one:
+        return (PTT[0], locked[0], reachable[0])
+    return (PTT, locked, reachable)
+
+
+def GetMirrorPositionArray(mirror, Segments, PTT, locked, reachable):
+    """
+    Fills in place the (N, 3) positions and (N,) locked and reachable
+    flags of the N segments given
+    """
+    state = _get(mirror)
+    idx = _index(state, Segments)
+    _wait()
+    with state['lock']:
+        PTT[:] = state['position'][idx]
+        locked[:] = state['locked'][idx]
+        reachable[:] = state['reachable'][idx]
+    return (PTT, locked, reachable)
+
+
+def SetModalPosition(mirror, CoefficientValueCouples):
+    """
+    Stages modal coefficients, as a (coefficient number, value) tuple
+    or a list of them. The segments are set to the sum of the modes
+    staged, on a hexagonal geometry (see memsModal)
+    """
+    if isinstance(CoefficientValueCouples, tuple):
+        CoefficientValueCouples = [CoefficientValueCouples]
+    state = _get(mirror)
+    _wait()
+    with state['lock']:
+        if state['modal_matrix'] is None:
+            state['modal_matrix'] = memsModal.modal_matrix(memsModal.hex_centers(state['nseg']),
+                                                           MEMSNMODES)
+        for coef, value in CoefficientValueCouples:
+            if not 0 <= int(coef) < MEMSNMODES:
+                raise RuntimeError("Invalid coefficient number, should be in 0..{}".format(MEMSNMODES - 1))
+            state['modal'][int(coef)] = float(value)
+        state['command'][:] = memsModal.modal_to_zonal(state['modal_matrix'], state['modal'])
+
+
+def MirrorCommand(mirror, mirrorCommand):
+    """
+    MirrorSendSettings applies the staged positions, clipped to the
+    range of the segments. MirrorInitSettings flattens the mirror
+    """
+    state = _get(mirror)
+    _wait()
+    with state['lock']:
+        if mirrorCommand == MirrorInitSettings:
+            state['command'][:] = 0
+            state['modal'][:] = 0
+        elif mirrorCommand != MirrorSendSettings:
+            raise RuntimeError("Invalid mirror command: {}".format(mirrorCommand))
+        command = state['command']
+        position = state['position']
+        np.clip(command[:, 0], -PISTONSTROKE, PISTONSTROKE, out=position[:, 0])
+        np.clip(command[:, 1:], -TIPTILTSTROKE, TIPTILTSTROKE, out=position[:, 1:])
+        state['reachable'][:] = (position == command).all(axis=1)
+        # locked segments do not move
+        position[state['locked']] = 0
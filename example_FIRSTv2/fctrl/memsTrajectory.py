@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  FIRSTCTRL - Pupil remapping control software
+#  Copyright (C) 2016  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+################################################################################
+##################            Shape trajectories            ####################
+################################################################################
+
+
+# Smooth transitions of the mems between two shapes. The intermediate positions
+# of all segments are computed at once, as a (T, N, 3) array, and streamed to
+# the mems by a dedicated thread, each step at its own deadline, so that the
+# caller is not blocked.
+
+
+import time
+from threading import Thread, Condition, Event
+
+import numpy as np
+
+
+__all__ = ['PROFILES', 'profile', 'make_trajectory', 'Trajectory', 'TrajectoryPlayer']
+
+
+################################################################################
+##################           Function definition            ####################
+################################################################################
+
+
+# Fraction of the way done, as a function of the fraction of the time elapsed
+PROFILES = {'linear': lambda t: t,
+            'cosine': lambda t: (1 - np.cos(np.pi * t)) / 2.,
+            'minjerk': lambda t: t**3 * (10 - 15 * t + 6 * t**2)}
+
+
+def profile(kind, nsteps):
+    """
+    Returns the (nsteps,) fractions of the way done at each step, from
+    the first step after the start to the end (1)
+
+    Args:
+      * kind (str): 'linear', 'cosine' or 'minjerk'
+      * nsteps (int): the number of steps
+    """
+    if kind not in PROFILES:
+        raise ValueError("Profile should be one of {}".format(sorted(PROFILES)))
+    return PROFILES[kind](np.arange(1, int(nsteps) + 1) / float(nsteps))
+
+
+def make_trajectory(start, end, nsteps, kind='minjerk'):
+    """
+    Returns the (nsteps, N, 3) positions going from the (N, 3) start
+    positions to the (N, 3) end positions, start excluded
+
+    Args:
+      * start, end (arrays): the positions
+      * nsteps (int): the number of steps
+      * kind (str): the profile, see profile
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    frac = profile(kind, max(int(nsteps), 1))
+    return start + frac[:, None, None] * (end - start)
+
+
+class Trajectory(object):
+    def __init__(self, elm, positions, period, skip_late=True):
+        """
+        Positions of some segments to be sent one after the other
+
+        Args:
+          * elm (list of int): the segments
+          * positions (array): (T, N, 3) positions of the N segments
+          * period (float): time between two steps, in s
+          * skip_late (bool): skips the steps already overdue, so that
+            the trajectory does not drift late; False sends every step,
+            e.g. for scans
+        """
+        self.elm = elm
+        self.positions = positions
+        self.period = float(period)
+        self.skip_late = bool(skip_late)
+        self.cancelled = False
+        self.error = None
+        self.sent = 0
+        self.skipped = 0
+        self._done = Event()
+
+    @property
+    def done(self):
+        """
+        If the trajectory was played until the end, or cancelled
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the trajectory is done, returns False on timeout
+        """
+        return self._done.wait(timeout)
+
+
+class TrajectoryPlayer(Thread):
+    def __init__(self, send, report=print):
+        """
+        Plays the trajectories, one at a time. Playing a new one cancels
+        the one being played
+
+        Args:
+          * send (callable): send(trajectory, positions) sends the
+            (N, 3) positions of the segments trajectory.elm to the mems,
+            unless the trajectory was cancelled in the meantime
+          * report (callable): report(message) prints the errors raised
+            while playing a trajectory, which is then stopped where it is
+        """
+        super().__init__()
+        self.daemon = True
+        self.running = True
+        self._send = send
+        self._report = report
+        self._cond = Condition()
+        self._current = None
+        self._next = None
+
+    def play(self, trajectory):
+        """
+        Plays the trajectory as soon as possible, and returns it
+        """
+        with self._cond:
+            self._cancel()
+            self._next = trajectory
+            self._cond.notify_all()
+        return trajectory
+
+    def _cancel(self):
+        for item in (self._current, self._next):
+            if item is not None:
+                item.cancelled = True
+        if self._next is not None:
+            self._next._done.set()
+            self._next = None
+        self._cond.notify_all()
+
+    def cancel(self):
+        """
+        Stops the trajectory being played, where it is
+        """
+        with self._cond:
+            self._cancel()
+
+    @property
+    def busy(self):
+        """
+        If a trajectory is being played
+        """
+        return self._current is not None or self._next is not None
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cancel()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._next is None and self.running:
+                    self._cond.wait()
+                if not self.running:
+                    break
+                trajectory = self._current = self._next
+                self._next = None
+            try:
+                self._play(trajectory)
+            except Exception as e:
+                # the player keeps going with the next trajectories
+                trajectory.error = e
+                self._report("ERROR: Trajectory stopped: {}".format(e))
+            finally:
+                with self._cond:
+                    self._current = None
+                trajectory._done.set()
+
+    def _play(self, trajectory):
+        """
+        Sends each step at its deadline. The steps already overdue are
+        skipped if trajectory.skip_late
+        """
+        nsteps = len(trajectory.positions)
+        period = trajectory.period
+        t0 = time.time()
+        k = 0
+        while k < nsteps:
+            with self._cond:
+                if trajectory.cancelled or not self.running:
+                    return
+                dt = t0 + k * period - time.time()
+                if dt > 0:
+                    # woken up early by a cancel
+                    self._cond.wait(dt)
+                    continue
+            if trajectory.skip_late and period > 0:
+                due = min(int((time.time() - t0) / period), nsteps - 1)
+                if due > k:
+                    trajectory.skipped += due - k
+                    k = due
+            self._send(trajectory, trajectory.positions[k])
+            trajectory.sent += 1
+            k += 1
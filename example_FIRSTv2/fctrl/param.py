@@ -30,9 +30,23 @@ DRIVERNUM = '04160165'
 NSEGMENTS = 37
 FIRSTSEGS = [37, 9, 24, 35, 7, 4, 33, 15, 28]#[5, 11, 17, 20, 22, 27, 29, 31, 36]
 
+# use a software simulation of the mems instead of IrisAO_PythonAPI
+MEMSSIMULATED = False
+MEMSSIMLATENCY = 0.  # time taken by each simulated driver access, in s
+MEMSSIMLOCKED = []  # segments simulated as locked
+
 IMGLAG = 0.05  # lag to get image from andor
 MEMSLAG = 0.05  # lag to move mems
 
+MEMSPUBMAXRATE = 100  # max refresh rate of the opd shared memory, in Hz (0 for no limit)
+MEMSREADBACKPERIOD = 1.  # period of the positions read back from the mems, in s (0 to disable)
+MEMSHISTORYSIZE = 100  # number of read back positions kept in memory
+MEMSNMODES = 55  # number of zernike modes of the modal commands
+MEMSSEGPITCH = 0.6062  # distance between two neighbour segments, in mm
+MEMSTRANSITIONTIME = 0.  # default duration of the on/off/shape transitions, in s (0 to jump at once)
+MEMSTRANSITIONPROFILE = 'minjerk'  # default profile of the transitions: linear, cosine or minjerk
+MEMSTRAJRATE = 100  # rate of the positions streamed during a transition, in Hz
+
 TIPTILTMIN = -5  # in units given to the mems
 TIPTILTMAX = 5  # in units given to the mems
 PISTONMIN = -3  # in units given to the mems
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('zmq')
+import com_zmq
+
+
+ADDRESS = b'mems'
+
+
+def wire(frames):
+    # what the subscriber gets from recv_multipart
+    return [np.ascontiguousarray(f).tobytes() if isinstance(f, np.ndarray) else bytes(f)
+            for f in frames]
+
+
+def test_set_pos_unsorted_segments():
+    frames = com_zmq.encode_set_pos(ADDRESS, [5, 2, 9], piston=[0.5, 0.2, 0.9],
+                                    tip=[-5, -2, -9], tilt=[1, 2, 3])
+    assert frames[0] == ADDRESS
+    command, kwargs = com_zmq.decode_command(wire(frames))
+    assert command == 'set_pos'
+    assert kwargs['elm'] == [2, 5, 9]
+    np.testing.assert_array_equal(kwargs['piston'], [0.2, 0.5, 0.9])
+    np.testing.assert_array_equal(kwargs['tip'], [-2, -5, -9])
+    np.testing.assert_array_equal(kwargs['tilt'], [2, 1, 3])
+
+
+def test_set_pos_all():
+    values = np.linspace(-1, 1, 37)
+    frames = com_zmq.encode_set_pos(ADDRESS, 'all', piston=values, tilt=values[::-1])
+    command, kwargs = com_zmq.decode_command(wire(frames))
+    assert command == 'set_pos'
+    assert kwargs['elm'] == 'all'
+    assert 'tip' not in kwargs
+    np.testing.assert_array_equal(kwargs['piston'], values)
+    np.testing.assert_array_equal(kwargs['tilt'], values[::-1])
+
+
+def test_set_pos_first_no_axes():
+    command, kwargs = com_zmq.decode_command(wire(com_zmq.encode_set_pos(ADDRESS, 'First')))
+    assert (command, kwargs) == ('set_pos', {'elm': 'first'})
+
+
+def test_set_pos_scalar_and_array():
+    scalar = com_zmq.decode_command(wire(com_zmq.encode_set_pos(ADDRESS, 3, 0.1, None, 0.3)))[1]
+    array = com_zmq.decode_command(wire(com_zmq.encode_set_pos(ADDRESS, [3], [0.1], None, [0.3])))[1]
+    assert scalar['elm'] == array['elm'] == [3]
+    assert 'tip' not in scalar and 'tip' not in array
+    for axis in ('piston', 'tilt'):
+        assert scalar[axis].shape == (1,)
+        np.testing.assert_array_equal(scalar[axis], array[axis])
+
+
+def test_call():
+    frames = com_zmq.encode_call(ADDRESS, 'shape_load', name='abc', elm=np.array([1, 2]), wait=True)
+    command, kwargs = com_zmq.decode_command(wire(frames))
+    assert command == 'shape_load'
+    assert kwargs == {'name': 'abc', 'elm': [1, 2], 'wait': True}
+
+
+def test_unknown_opcode():
+    frames = [ADDRESS, com_zmq.CMD_HEADER.pack(9, 0, 0, 0)]
+    with pytest.raises(ValueError):
+        com_zmq.decode_command(frames)
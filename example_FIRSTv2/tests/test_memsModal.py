@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+import memsModal
+
+
+NMODES = 21
+
+
+def test_modal_round_trip():
+    matrix = memsModal.modal_matrix(memsModal.hex_centers(37), NMODES)
+    assert matrix.shape == (37 * 3, NMODES)
+    pinv = memsModal.modal_pinv(matrix)
+    coefs = np.random.RandomState(0).uniform(-1, 1, NMODES)
+    pos = memsModal.modal_to_zonal(matrix, coefs)
+    assert pos.shape == (37, 3)
+    np.testing.assert_allclose(memsModal.zonal_to_modal(pinv, pos), coefs, atol=1e-10)
+
+
+def test_modal_to_zonal_couples():
+    matrix = memsModal.modal_matrix(memsModal.hex_centers(37), NMODES)
+    coefs = np.zeros(NMODES)
+    coefs[[0, 4]] = [0.5, -0.2]
+    np.testing.assert_allclose(memsModal.modal_to_zonal(matrix, [(0, 0.5), (4, -0.2)]),
+                               memsModal.modal_to_zonal(matrix, coefs))
+    # short vectors are padded with zeros
+    np.testing.assert_allclose(memsModal.modal_to_zonal(matrix, coefs[:5]),
+                               memsModal.modal_to_zonal(matrix, coefs))
+
+
+def test_piston_mode():
+    # mode 0 is a uniform piston, without tip nor tilt
+    matrix = memsModal.modal_matrix(memsModal.hex_centers(37), 1)
+    pos = memsModal.modal_to_zonal(matrix, [1.])
+    np.testing.assert_allclose(pos[:, 0], 1.)
+    np.testing.assert_allclose(pos[:, 1:], 0., atol=1e-12)
+
+
+def test_load_modal_matrix_cache(tmpdir):
+    centers = os.path.join(str(tmpdir), 'centers.txt')
+    cache = os.path.join(str(tmpdir), 'cache.npz')
+    np.savetxt(centers, memsModal.hex_centers(37, pitch=20.))
+    first = memsModal.load_modal_matrix(centers, NMODES, cache)
+    assert os.path.isfile(cache)
+    np.testing.assert_array_equal(memsModal.load_modal_matrix(centers, NMODES, cache), first)
+    # another geometry invalidates the cache
+    np.savetxt(centers, memsModal.hex_centers(19, pitch=20.))
+    assert memsModal.load_modal_matrix(centers, NMODES, cache).shape == (19 * 3, NMODES)
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+
+import memsTrajectory
+
+
+def test_make_trajectory():
+    pos = memsTrajectory.make_trajectory(np.zeros((2, 3)), np.ones((2, 3)), 4, kind='linear')
+    assert pos.shape == (4, 2, 3)
+    np.testing.assert_allclose(pos[:, 0, 0], [0.25, 0.5, 0.75, 1.])
+
+
+def test_player_survives_send_error():
+    errors = []
+    sent = []
+
+    def send(trajectory, positions):
+        if trajectory.elm == 'bad':
+            raise IOError('mems unplugged')
+        sent.append(positions)
+
+    player = memsTrajectory.TrajectoryPlayer(send, report=errors.append)
+    player.start()
+    try:
+        bad = player.play(memsTrajectory.Trajectory('bad', np.zeros((3, 1, 3)), 0.))
+        assert bad.wait(1.)
+        assert isinstance(bad.error, IOError)
+        assert len(errors) == 1
+        good = player.play(memsTrajectory.Trajectory([0], np.zeros((3, 1, 3)), 0.))
+        assert good.wait(1.)
+        assert good.error is None and len(sent) == 3
+    finally:
+        player.stop()
+
+
+def test_no_skip_late():
+    def send(trajectory, positions):
+        time.sleep(0.02)
+
+    player = memsTrajectory.TrajectoryPlayer(send)
+    player.start()
+    try:
+        trajectory = player.play(memsTrajectory.Trajectory([0], np.zeros((5, 1, 3)), 0.001,
+                                                           skip_late=False))
+        assert trajectory.wait(2.)
+        assert trajectory.sent == 5 and trajectory.skipped == 0
+    finally:
+        player.stop()
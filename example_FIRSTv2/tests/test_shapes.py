@@ -0,0 +1,48 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+pytest.importorskip('scipy')
+pytest.importorskip('patiencebar')
+import core
+
+
+def test_shape_round_trip(tmpdir):
+    name = os.path.join(str(tmpdir), 'test.shape')
+    arr = np.random.RandomState(0).uniform(-1, 1, (core.NSEGMENTS, 3))
+    core.save_shape(name, arr)
+    pos, meta = core.load_shape(name)
+    np.testing.assert_array_equal(pos, arr)
+    assert meta['nsegments'] == core.NSEGMENTS
+    assert meta['mirror'] == core.MIRRORNUM
+    # read again from the cache
+    np.testing.assert_array_equal(core.load_shape(name)[0], arr)
+
+
+def test_shape_overwritten(tmpdir):
+    name = os.path.join(str(tmpdir), 'test.shape')
+    core.save_shape(name, np.zeros((core.NSEGMENTS, 3)))
+    core.load_shape(name)
+    core.save_shape(name, np.ones((core.NSEGMENTS, 3)))
+    np.testing.assert_array_equal(core.load_shape(name)[0], 1.)
+
+
+def test_legacy_text_shape(tmpdir):
+    name = os.path.join(str(tmpdir), 'legacy.shape')
+    arr = np.arange(core.NSEGMENTS * 3, dtype=float).reshape(-1, 3)
+    np.savetxt(name, arr)
+    pos, meta = core.load_shape(name)
+    np.testing.assert_array_equal(pos, arr)
+    assert meta == {}
+
+
+def test_shape_is_npz(tmpdir):
+    name = os.path.join(str(tmpdir), 'test.shape')
+    arr = np.ones((core.NSEGMENTS, 3))
+    core.save_shape(name, arr)
+    with np.load(name) as data:
+        np.testing.assert_array_equal(data['pos'], arr)
+        assert json.loads(data['meta'].item())['nsegments'] == core.NSEGMENTS
@@ -27,9 +27,17 @@
 
 from ctypes import *
 import time
+import numpy as np
+from threading import Thread, Condition, Event, Lock
 from PIL import Image
 
-__all__ = ['Andor']
+__all__ = ['Andor', 'FrameGrabber']
+
+# Number of frame buffers used in turn by GetMostRecentImage, so that the
+# previous frames remain valid while the next one is read
+NBUFFERS = 3
+# Number of frames kept by FrameGrabber
+RINGSIZE = 32
 
 """Andor class which is meant to provide the Python version of the same
    functions that are defined in the Andor's SDK. Since Python does not
@@ -76,7 +84,16 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
         self.pixsize = None
         self.numberframes = 1
         self.maxbuffersize = None
+        self.lostframes = []
         self.max_exp = 0.
+        self.kinetic_cycle_time = 0.
+        # the exposure or kinetic settings changed since GetAcqTimings
+        self.timings_changed = True
+
+        # preallocated frame buffers, filled in place by the sdk
+        self._buffers = [np.empty((self.height, self.width), dtype=np.int32) for i in range(NBUFFERS)]
+        self._ibuffer = 0
+        self.imageArray = self._buffers[0]
 
         #self.Temperature = Temperature(self)
 
@@ -93,6 +110,7 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
 
     def SetAcquisitionMode(self, mode):
         error = self.dll.SetAcquisitionMode(mode)
+        self.timings_changed = True
         return ERROR_CODE[error]
 
     def SetShutter(self, typ, mode, closingtime, openingtime):
@@ -108,24 +126,30 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
         # self.dll.WaitForAcquisition()   commented out because it doesnt work properly.
         return ERROR_CODE[error]
 
-    def GetAcquiredKineticSeriesData(self, imageArray):
+    def GetAcquiredKineticSeriesData(self, imageArray=None):
         """
-        Returns the data from the last acquisition as 32-bit signed integers.
+        Gets the data from the last acquisition as 32-bit signed integers,
+        in self.imageArray of shape (numberframes, height, width).
+        imageArray can be given as a C-contiguous int32 or uint16 array of
+        that shape, to be filled in place.
         """
-        dim = self.width * self.height * self.numberframes
-        cimageArray = c_int * dim
-        cimage = cimageArray()
-        error = self.dll.GetAcquiredData(pointer(cimage), dim)
-
-        for i in range(len(cimage)):
-            imageArray.append(cimage[i])
-
-        self.imageArray = imageArray[:]
+        shape = (self.numberframes, self.height, self.width)
+        if imageArray is None:
+            imageArray = np.empty(shape, dtype=np.int32)
+        elif imageArray.shape != shape or imageArray.dtype not in (np.int32, np.uint16) \
+                or not imageArray.flags.c_contiguous:
+            raise ValueError("imageArray should be a C-contiguous int32 or uint16 array of shape {}".format(shape))
+        if imageArray.dtype == np.uint16:
+            error = self.dll.GetAcquiredData16(imageArray.ctypes.data_as(POINTER(c_ushort)), imageArray.size)
+        else:
+            error = self.dll.GetAcquiredData(imageArray.ctypes.data_as(POINTER(c_int)), imageArray.size)
+        self.imageArray = imageArray
         return ERROR_CODE[error]
 
     def SetExposureTime(self, time):
         error = self.dll.SetExposureTime(c_float(time))
         self.exp_time = time
+        self.timings_changed = True
         return ERROR_CODE[error]
 
     def SetSingleScan(self):
@@ -219,7 +243,7 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
     def GetStatus(self):
         status = c_int()
         error = self.dll.GetStatus(byref(status))
-        self.status = ERROR_CODE[error]
+        self.status = ERROR_CODE[status.value]
         return ERROR_CODE[error]
 
     def SetOutputAmplifier(self, typ):
@@ -263,6 +287,7 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
 
     def SetKineticCycleTime(self, time):  ## for live video mode
         error = self.dll.SetKineticCycleTime(c_float(time))
+        self.timings_changed = True
         return ERROR_CODE[error]
 
     def SetVideoScan(self):
@@ -275,6 +300,7 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
     def SetNumberKinetics(self, number):
         number = c_int(number)
         error = self.dll.SetNumberKinetics(number)
+        self.timings_changed = True
         return ERROR_CODE[error]
 
     def SetFrameSeries(self):
@@ -282,15 +308,22 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
         self.SetAcquisitionMode(3)
         self.SetImage(1, 1, 1, self.width, 1, self.height)
 
-    def GetMostRecentImage(self, imageArray):
-        dim = self.width * self.height
-        cimageArray = c_int * dim
-        cimage = cimageArray()
-        error = self.dll.GetMostRecentImage(pointer(cimage), dim)
-        for i in range(len(cimage)):
-            imageArray.append(cimage[i])
+    def GetMostRecentImage(self, imageArray=None):
+        """
+        Gets the most recent image as 32-bit signed integers, in
+        self.imageArray of shape (height, width). It is read in the next
+        preallocated buffer, unless imageArray is given as a C-contiguous
+        int32 array of that shape, to be filled in place.
+        """
+        if imageArray is None:
+            self._ibuffer = (self._ibuffer + 1) % NBUFFERS
+            imageArray = self._buffers[self._ibuffer]
+        elif imageArray.shape != (self.height, self.width) or imageArray.dtype != np.int32 \
+                or not imageArray.flags.c_contiguous:
+            raise ValueError("imageArray should be a C-contiguous int32 array of shape {}".format((self.height, self.width)))
+        error = self.dll.GetMostRecentImage(imageArray.ctypes.data_as(POINTER(c_int)), imageArray.size)
         self.GetCurrentCamera()
-        self.imageArray = imageArray[:]
+        self.imageArray = imageArray
         return ERROR_CODE[error]
 
     def GetPixelSize(self, xSize=1, ySize=1):
@@ -317,6 +350,109 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
         self.maxbuffersize = buff.value
         return ERROR_CODE[error]
 
+    def GetNumberNewImages(self):
+        """
+        Gets the (first, last) indexes of the images of the circular buffer
+        that were not retrieved yet, in self.newimages
+        """
+        first = c_long()
+        last = c_long()
+        error = self.dll.GetNumberNewImages(byref(first), byref(last))
+        self.newimages = (first.value, last.value)
+        return ERROR_CODE[error]
+
+    def GetImages(self, first, last, imageArray):
+        """
+        Fills imageArray, a C-contiguous int32 or uint16 array of shape
+        (last - first + 1, height, width), with the images first to last
+        (indexes in the series, from 1) of the circular buffer
+        """
+        if imageArray.shape != (last - first + 1, self.height, self.width) \
+                or not imageArray.flags.c_contiguous:
+            raise ValueError("imageArray should be a C-contiguous array of shape {}".format(
+                                (last - first + 1, self.height, self.width)))
+        validfirst = c_long()
+        validlast = c_long()
+        if imageArray.dtype == np.uint16:
+            func, ctype = self.dll.GetImages16, c_ushort
+        elif imageArray.dtype == np.int32:
+            func, ctype = self.dll.GetImages, c_int
+        else:
+            raise ValueError("imageArray should be int32 or uint16")
+        error = func(c_long(first), c_long(last), imageArray.ctypes.data_as(POINTER(ctype)),
+                     c_ulong(imageArray.size), byref(validfirst), byref(validlast))
+        self.validimages = (validfirst.value, validlast.value)
+        return ERROR_CODE[error]
+
+    def AcquireCube(self, Nframes, KinCyclTime=0, dtype=np.int32, path=None, maxwaittime=10):
+        """
+        Acquires a kinetic series of Nframes images in self.imageArray,
+        a (Nframes, height, width) array of int32 or uint16.
+        If path is given, the cube is a .npy file mapped in memory, so
+        that the frames are streamed to disk as they are retrieved.
+        The series is retrieved in one transfer if it fits in the
+        circular buffer, or else in chunks while it is acquired.
+        maxwaittime (s) is the longest time waited for a new frame.
+        The camera is left idle afterwards.
+        The indexes of the frames that could not be retrieved, lost in
+        a circular buffer overrun or after an error, are listed in
+        self.lostframes; these frames are set to 0.
+        """
+        shape = (Nframes, self.height, self.width)
+        if path is None:
+            cube = np.empty(shape, dtype=dtype)
+        else:
+            cube = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        self.imageArray = cube
+        self.lostframes = []
+        self.AbortAcquisition()
+        self.SetSeriesScanParam(Nframes, KinCyclTime)
+        self.SetImage(1, 1, 1, self.width, 1, self.height)
+        self.GetSizeOfCircularBuffer()
+        error = self.StartAcquisition()
+        nread = 0
+        if error != "DRV_SUCCESS":
+            pass
+        elif Nframes <= self.maxbuffersize:
+            # single transfer at the end of the series
+            if self.WaitForIdle(maxwaittime + Nframes * self.GetKinetic()) != "DRV_IDLE":
+                self.AbortAcquisition()
+                error = self.status
+            else:
+                error = self.GetAcquiredKineticSeriesData(cube)
+                if error == "DRV_SUCCESS":
+                    nread = Nframes
+        else:
+            # chunks of the frames acquired so far
+            t0 = time.time()
+            while nread < Nframes:
+                if self.GetNumberNewImages() != "DRV_SUCCESS":
+                    if time.time() - t0 > maxwaittime:
+                        self.AbortAcquisition()
+                        error = "DRV_NO_NEW_DATA"
+                        break
+                    time.sleep(0.001)
+                    continue
+                first, last = self.newimages
+                last = min(last, Nframes)
+                if first > nread + 1:
+                    # circular buffer overrun
+                    cube[nread:first - 1] = 0
+                    self.lostframes.extend(range(nread, first - 1))
+                error = self.GetImages(first, last, cube[first - 1:last])
+                if error != "DRV_SUCCESS":
+                    self.AbortAcquisition()
+                    nread = first - 1
+                    break
+                nread = last
+                t0 = time.time()
+        if nread < Nframes:
+            cube[nread:] = 0
+            self.lostframes.extend(range(nread, Nframes))
+        if path is not None:
+            cube.flush()
+        return error
+
     def WaitForIdle(self, maxwaittime=10):
         t0 = time.time()
         while ((time.time() - t0) <= maxwaittime):
@@ -336,6 +472,7 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
         c_exposure = c_float()
         c_accumulate = c_float()
         c_kinetic = c_float()
+        self.timings_changed = False
         error = self.dll.GetAcquisitionTimings(byref(c_exposure), byref(c_accumulate), byref(c_kinetic))
         self.exp_time = c_exposure.value
         self.accu_cycle_time = c_accumulate.value
@@ -422,6 +559,166 @@ class Andor(object):  #### (OBJECT) ADDED BY SEB
 
 
 
+class FrameGrabber(Thread):
+    """
+    Continuously pulls the frames of the running video acquisition of
+    an Andor camera into a ring of nframes preallocated (height, width)
+    int32 arrays. Each frame is tagged with its index in the series and
+    the time of the end of its readout.
+
+    The frames are numbered from 0 in the order they are grabbed: frame
+    number k is in slot k % nframes until it gets overwritten. Readers
+    never block the grabber; they check the tag of the slot after
+    reading it to detect a frame overwritten meanwhile.
+    """
+    def __init__(self, cam, nframes=RINGSIZE, polltime=0.001):
+        Thread.__init__(self)
+        self.daemon = True
+        self.cam = cam
+        self.nframes = nframes
+        self.polltime = polltime  # s, between two checks for new frames
+        self.frames = np.zeros((nframes, cam.height, cam.width), dtype=np.int32)
+        self.number = np.zeros(nframes, dtype=np.int64) - 1  # -1 while written
+        self.index = np.zeros(nframes, dtype=np.int64)
+        self.times = np.zeros(nframes)
+        self.count = 0  # number of frames grabbed
+        self.cycletime = 0.  # s, kinetic cycle time of the camera
+        self.dropped = 0  # number of frames lost by the camera circular buffer
+        self.running = False
+        self._cond = Condition()
+        self._resumed = Event()
+        self._resumed.set()
+        # held while the grabber uses the camera
+        self._busy = Lock()
+
+    def run(self):
+        self.running = True
+        last = 0
+        while self.running:
+            self._resumed.wait()
+            with self._busy:
+                # paused while waiting for the lock
+                if not self._resumed.is_set() or not self.running:
+                    continue
+                if self.cam.timings_changed:
+                    self.cam.GetAcqTimings()
+                    self.cycletime = self.cam.kinetic_cycle_time
+                nodata = self.cam.GetNumberNewImages() != "DRV_SUCCESS"
+                if not nodata:
+                    first, newest = self.cam.newimages
+                    t = time.time()
+                    if first <= last:
+                        # the acquisition was restarted
+                        last = first - 1
+                    elif first > last + 1 and last > 0:
+                        self.dropped += first - last - 1
+                    for i in range(first, newest + 1):
+                        k = self.count
+                        slot = k % self.nframes
+                        self.number[slot] = -1
+                        if self.cam.GetImages(i, i, self.frames[slot:slot + 1]) != "DRV_SUCCESS":
+                            break
+                        self.index[slot] = i
+                        self.times[slot] = t - (newest - i) * self.cycletime
+                        self.number[slot] = k
+                        with self._cond:
+                            self.count = k + 1
+                            self._cond.notify_all()
+                        last = i
+            if nodata:
+                time.sleep(self.polltime)
+
+    def stop(self):
+        self.running = False
+        self._resumed.set()
+        self.join()
+
+    def pause(self):
+        """
+        Stops grabbing the frames, e.g. while the camera is used for
+        something else. Returns once the grabber is done with the
+        camera
+        """
+        self._resumed.clear()
+        # waits for the frames being retrieved
+        with self._busy:
+            pass
+
+    def resume(self):
+        self._resumed.set()
+
+    def _wait(self, k, timeout=None):
+        """
+        Waits until the frame number k is grabbed, returns False if
+        timeout (s) expired
+        """
+        if self.count <= k:
+            t0 = time.time()
+            with self._cond:
+                while self.count <= k:
+                    left = None if timeout is None else timeout - (time.time() - t0)
+                    if left is not None and left <= 0:
+                        return False
+                    self._cond.wait(left)
+        return True
+
+    def get(self, k, out=None, timeout=None):
+        """
+        Returns the tuple (index, time, frame) of the frame number k,
+        waiting for it if it was not grabbed yet, or None if it was
+        overwritten or if timeout (s) expired.
+        The frame is copied in out, a (height, width) array, or in a new
+        array if out is None
+        """
+        if not self._wait(k, timeout):
+            return None
+        slot = k % self.nframes
+        if self.number[slot] != k:
+            return None
+        index, t = self.index[slot], self.times[slot]
+        if out is None:
+            out = self.frames[slot].copy()
+        else:
+            out[:] = self.frames[slot]
+        if self.number[slot] != k:
+            return None
+        return index, t, out
+
+    def latest(self, out=None):
+        """
+        Returns the tuple (number, index, time, frame) of the most recent
+        frame without waiting, or None if there is none yet
+        """
+        while self.count > 0:
+            k = self.count - 1
+            res = self.get(k, out=out)
+            if res is not None:
+                return (k,) + res
+        return None
+
+    def first_after(self, t, out=None, timeout=None):
+        """
+        Returns the tuple (number, index, time, frame) of the first frame
+        read out after t (time.time()), waiting for it if needed, or None
+        if timeout (s) expired. Only that frame is copied
+        """
+        t0 = time.time()
+        k = max(0, self.count - self.nframes + 1)
+        while True:
+            left = None if timeout is None else max(0, timeout - (time.time() - t0))
+            if not self._wait(k, left):
+                return None
+            slot = k % self.nframes
+            if self.number[slot] == k and self.times[slot] <= t:
+                k += 1
+                continue
+            res = self.get(k, out=out) if self.number[slot] == k else None
+            if res is not None:
+                return (k,) + res
+            # overwritten, catch up
+            k = max(k + 1, self.count - self.nframes + 1)
+
+
 ERROR_CODE = {
     20001: "DRV_ERROR_CODES",
     20002: "DRV_SUCCESS",
@@ -49,7 +49,7 @@ class AndorCtrl(jk.Joystick):
 
     @_callit('before', 'init')
     def _init_data(self, *args, **kwargs):
-	
+
         print("Initializing Andor Camera .... ")
         #self.cam = andorsdk.Andor()
         self.cam = andor.Andor()
@@ -62,6 +62,7 @@ class AndorCtrl(jk.Joystick):
 
 
         self._txtlog = {}
+        self._cube_running = False
         self.auto_cmap_adjust = True
         self.log = False
         self.camsize = (self.cam.width, self.cam.height)
@@ -69,9 +70,14 @@ class AndorCtrl(jk.Joystick):
         self._dark = np.zeros(self.camsize).astype(np.int16)
 
         #self.cam.exposure = core.DEFAULTEXPOSURETIME  # ms
-	self.cam.exposure = 100  # ms
+        self.cam.exposure = 100  # ms
         self.cam.SetVideoScan()
         self.cam.StartAcquisition()
+        # frames are pulled in the background, and read by the display
+        self.grabber = andor.FrameGrabber(self.cam)
+        self.grabber.start()
+        self._framenb = -1
+        self._framebuf = np.zeros((self.cam.height, self.cam.width), dtype=np.int32)
 
         # needed for boxcal show_boxes
         self._boxcal._szratio = self.camsize[0]*1./self.camsize[1]
@@ -105,6 +111,11 @@ class AndorCtrl(jk.Joystick):
             xstop = xstart + box_pxsize[1]
             self._subimgboxes.append([slice(ystart, ystop),
                                       slice(xstart, xstop)])
+        # pixel indexes of the boxes in the sub img, to fill them at once
+        self._subimg_iy = np.array([sby.start for sby, sbx in self._subimgboxes])[:, None, None]\
+                            + np.arange(box_pxsize[0])[:, None]
+        self._subimg_ix = np.array([sbx.start for sby, sbx in self._subimgboxes])[:, None, None]\
+                            + np.arange(box_pxsize[1])
 
     @_callit('after', 'init')
     def _build_frames(self, *args, **kwargs):
@@ -131,13 +142,18 @@ class AndorCtrl(jk.Joystick):
 
     @_infinite_loop(wait_time=0.12)
     def _get_data(self):
+        if self._cube_running:
+            return
         #error = self.cam.dll.SetCurrentCamera(self.cam.camera_handle)
         #self.lastimg = self.cam.Acquire.Newest(1).astype(np.int16).reshape((496,658)).T
-        self.rawdata = []
         #print(self.cam.GetStatus())
-        self.cam.GetMostRecentImage(self.rawdata)
-        #self.lastimg = np.reshape(self.rawdata,(496, 658)).T
-        self.lastimg = np.reshape(self.cam.imageArray,(496, 658)).T
+        frame = self.grabber.latest(out=self._framebuf)
+        if frame is None or frame[0] == self._framenb:
+            # no new frame
+            return
+        self._framenb = frame[0]
+        # (width, height) view on the latest frame
+        self.lastimg = self._framebuf.T
         #try:
             #self.lastimg = self.cam.Acquire.Newest(1).astype(np.int16)
         #    self.lastimg = self.cam.Acquire.Newest(1).astype(np.int16).reshape((496,658)).T
@@ -150,13 +166,11 @@ class AndorCtrl(jk.Joystick):
             data = np.log(np.clip(data, a_min=data[data>0].min(), a_max=1e99))
         if core.SHOWANDORBIGIMAGE:
             self.img.set_data(data)
+        sums, maxs, centroids = self._boxcal.extract(data)
         for idx, seg in enumerate(core.FIRSTSEGS):
-            by, bx = self._boxcal.boxes[idx]
-            cut = data[by.start:by.stop,bx.start:bx.stop]
-            sby, sbx = self._subimgboxes[idx]
-            self._txtlog['sum'+str(seg)] = cut.sum()
-            self._txtlog['max'+str(seg)] = cut.max()
-            self.lastsubimg[sby.start:sby.stop,sbx.start:sbx.stop] = cut
+            self._txtlog['sum'+str(seg)] = sums[idx]
+            self._txtlog['max'+str(seg)] = maxs[idx]
+        self.lastsubimg[self._subimg_iy, self._subimg_ix] = self._boxcal.cuts(data)
         self.subimg.set_data(self.lastsubimg)
         self.cts.clear()
         # auto-adjust cmap
@@ -197,7 +211,8 @@ class AndorCtrl(jk.Joystick):
                     'Target temperature (C)')
             ])
         hd.add_comment('Written by Guillaume SCHWORER')
-        last = self.lastimg
+        # the frame buffer is reused, so the image is copied
+        last = self.lastimg.copy()
         dark = self.dark
         hdulist.append(pf.ImageHDU(data=last-dark, header=hd))
         hdulist.append(pf.ImageHDU(data=last,
@@ -207,6 +222,48 @@ class AndorCtrl(jk.Joystick):
         hdulist.writeto(name, clobber=override)
         print("Saved in '{}'".format(name))
 
+    def acq_cube(self, nframes, name=None, override=False):
+        """
+        Acquires a cube of nframes images in one kinetic series, and
+        returns it as a (nframes, width, height) array. The video
+        stream is paused meanwhile. The frames that could not be
+        retrieved are set to 0, and their indexes listed in
+        self.cam.lostframes
+
+        Args:
+          * nframes (int): the number of frames
+          * name (str or None): if given, the name of the .npy file
+            where the frames are streamed
+          * override (bool): whether to override an existing file
+        """
+        path = None
+        if name is not None:
+            path = os.path.join(core.PATHIMG,
+                                datetime.utcnow().strftime(core.IMGFILENAME)\
+                                        .format(name=core.clean_txt(str(name))))
+            path = os.path.splitext(path)[0] + '.npy'
+            if os.path.isfile(path) and not bool(override):
+                print("File '{}' already exists".format(path))
+                return
+        self._cube_running = True
+        self.grabber.pause()
+        try:
+            ret = self.cam.AcquireCube(int(nframes), path=path)
+            cube = self.cam.imageArray
+        finally:
+            self.cam.SetVideoScan()
+            self.cam.StartAcquisition()
+            self.grabber.resume()
+            self._cube_running = False
+        if ret != "DRV_SUCCESS":
+            print("Cube acquisition failed: {}".format(ret))
+        elif path is not None:
+            print("Saved in '{}'".format(path))
+        if len(self.cam.lostframes) > 0:
+            print("{} frames lost, set to 0, see cam.lostframes".format(len(self.cam.lostframes)))
+        # same orientation as lastimg
+        return cube.transpose(0, 2, 1)
+
     def save_dark(self, name, override=False):
         """
         Saves the current dark to file
@@ -279,6 +336,7 @@ class AndorCtrl(jk.Joystick):
     @_callit('after', 'exit')
     def _exit_warning(self):
         print("Exiting")
+        self.grabber.stop()
         self.cam.ShutDown()
         time.sleep(1)
 
@@ -294,11 +352,12 @@ class AndorCtrl(jk.Joystick):
         Acquires a dark frame that will be subtracted to the
         current video stream
         """
-	self.rawdata = []
         #self._dark = self.cam.Acquire.Newest(1).astype(np.int16)
-	self.cam.GetMostRecentImage(self.rawdata)
-        #self.lastimg = np.reshape(self.rawdata,(496, 658)).T
-        self._dark = np.reshape(self.cam.imageArray,(496, 658)).T
+        frame = self.grabber.latest()
+        if frame is None:
+            print("No frame acquired yet")
+            return
+        self._dark = frame[3].T
         self._txtlog['dark'] = True
 
     def rm_dark(self):
@@ -72,6 +72,7 @@ class BoxCal(object):
 
         self._nfib = int(nfib)
         self._boxes = []
+        self._plan = None
         self._centers = np.zeros((self._nfib, 2))
         self.box_pxsize = box_pxsize
 
@@ -126,6 +127,73 @@ class BoxCal(object):
             xmin = int(max(0, v1-self.box_pxsize[1]//2))
             self._boxes.append([slice(ymin, ymin + self.box_pxsize[0]),
                                 slice(xmin, xmin + self.box_pxsize[1])])
+        # the extraction plan is made again for the new boxes
+        self._plan = None
+
+    def _make_plan(self, shape):
+        """
+        Pixel indexes of all boxes in an image of the given shape, to
+        cut them all at once
+        """
+        iy = np.array([sy.start for sy, sx in self._boxes], dtype=int)[:, None]\
+                + np.arange(self.box_pxsize[0])
+        ix = np.array([sx.start for sy, sx in self._boxes], dtype=int)[:, None]\
+                + np.arange(self.box_pxsize[1])
+        # boxes crossing the image edges are cut, as slices would
+        valid = (iy[:, :, None] < shape[0]) & (ix[:, None, :] < shape[1])
+        self._plan = {'shape': tuple(shape),
+                      'iy': np.clip(iy, 0, shape[0]-1)[:, :, None],
+                      'ix': np.clip(ix, 0, shape[1]-1)[:, None, :],
+                      'y': iy.astype(float), 'x': ix.astype(float),
+                      'valid': None if valid.all() else valid}
+        return self._plan
+
+    def cuts(self, img):
+        """
+        Cuts all boxes of an image, or of a cube of images, at once
+
+        Args:
+          * img (array): an image, or a cube (..., Y, X) of images
+
+        Returns:
+          * the cuts, as a (..., nfib, box Y-size, box X-size) array
+        """
+        img = np.asarray(img)
+        plan = self._plan
+        if plan is None or plan['shape'] != img.shape[-2:]:
+            plan = self._make_plan(img.shape[-2:])
+        cuts = img[..., plan['iy'], plan['ix']]
+        if plan['valid'] is not None:
+            cuts = np.where(plan['valid'], cuts, 0)
+        return cuts
+
+    def extract(self, img):
+        """
+        Extracts the fluxes of all boxes of an image, or of a cube of
+        images, at once
+
+        Args:
+          * img (array): an image, or a cube (..., Y, X) of images
+
+        Returns:
+          * the sums, as a (..., nfib) array
+          * the maxima, as a (..., nfib) array
+          * the Y-X flux-weighted centroids, as a (..., nfib, 2) array
+        """
+        cuts = self.cuts(img)
+        plan = self._plan
+        prof_y = cuts.sum(axis=-1)
+        prof_x = cuts.sum(axis=-2)
+        sums = prof_y.sum(axis=-1)
+        if plan['valid'] is None:
+            maxs = cuts.max(axis=(-2, -1))
+        else:
+            maxs = np.where(plan['valid'], cuts, cuts.min()).max(axis=(-2, -1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centroids = np.stack(((prof_y * plan['y']).sum(axis=-1) / sums,
+                                  (prof_x * plan['x']).sum(axis=-1) / sums),
+                                 axis=-1)
+        return sums, maxs, centroids
 
     @property
     def boxes(self):
@@ -238,6 +306,7 @@ class BoxCal(object):
             np.savetxt(name,
                        np.r_[np.array([self._box_pxsize]), self._centers],
                        header="1st row is box_size, then (nfib, 2) shape")
+            core.index_filepath(name)
             print("Saved in '{}'".format(name))
         else:
             print("File '{}' already exists".format(name))
@@ -265,6 +334,7 @@ class BoxCal(object):
         name = core.make_filepath_nostamp(name, core.BOXESFILENAME)
         if os.path.isfile(name):
             os.remove(name)
+            core.unindex_filepath(name)
             print("Removed: '{}'".format(name))
         else:
             print("File '{}' not found".format(name))
@@ -276,7 +346,7 @@ class BoxCal(object):
         Args:
           * name (str): the name of the file to load
         """
-        name = core.make_filepath_nostamp(name, core.BOXESFILENAME)
+        name = core.make_filepath_nostamp(name, core.BOXESFILENAME, latest=True)
         if os.path.isfile(name):
             l = np.loadtxt(name)
             self._box_pxsize = list(map(int, l[0]))
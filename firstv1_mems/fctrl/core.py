@@ -47,16 +47,21 @@ import time
 import sys
 import os
 import glob
+import json
 import numpy as np
 from datetime import datetime
 
 from patiencebar import Patiencebar
 from scipy.ndimage import gaussian_filter
-import IrisAO_PythonAPI  as IrisAO_API
 
 
 from .param import *
 
+if MEMSSIMULATED:
+    from . import memssim as IrisAO_API
+else:
+    import IrisAO_PythonAPI  as IrisAO_API
+
 
 def concat_dir(*args):
     """
@@ -78,9 +83,9 @@ def rel_dir(*args):
     return concat_dir(ROOT, *args)
 
 
-AUTHCHARS = range(ord('A'), ord('Z')+1) \
-                + range(ord('a'), ord('z')+1) \
-                + range(ord('0'), ord('9')+1) \
+AUTHCHARS = list(range(ord('A'), ord('Z')+1)) \
+                + list(range(ord('a'), ord('z')+1)) \
+                + list(range(ord('0'), ord('9')+1)) \
                 + [ord('-'), ord('_')]
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -90,6 +95,12 @@ HOME = os.path.expanduser("~")
 PATHCONFIGFILE = home_dir(*PATHCONFIGFILE)
 PATHCALMEMS = home_dir(*PATHCALMEMS)
 PATHIMG = home_dir(*PATHIMG)
+PATHOPTI = home_dir(*PATHOPTI)
+
+# first bytes of the shape files (npz archive)
+NPZMAGIC = b'PK\x03\x04'
+# shapes already loaded, by file name
+_SHAPES = {}
 
 
 def clean_txt(txt):
@@ -128,6 +139,75 @@ def gauss2D(x, y, a=1., x0=0., y0=0., sigma=1., foot=0.):
 def gaussPt(x, y, a=1., x0=0., y0=0., sigma=1., foot=0.):
     return a*np.exp(-((x-x0)**2+(y-y0)**2)/(np.sqrt(2)*sigma)**2)+foot
 
+def fit_gaussPt(x, y, f):
+    """
+    Fits the gaussPt model (without foot) to the values f at the points
+    (x, y), as a paraboloid to log(f) weighted by f
+
+    Returns (a, x0, y0, sigma), or None if the points are not peaked
+    """
+    x, y, f = [np.asarray(item, dtype=float).ravel() for item in (x, y, f)]
+    good = f > 0
+    if good.sum() < 4:
+        return None
+    x, y, f = x[good], y[good], f[good]
+    A = np.column_stack((np.ones_like(x), x, y, x**2 + y**2)) * f[:, None]
+    c0, cx, cy, c2 = np.linalg.lstsq(A, np.log(f) * f, rcond=None)[0]
+    if c2 >= 0:
+        return None
+    x0 = -cx / (2*c2)
+    y0 = -cy / (2*c2)
+    sigma = np.sqrt(-1 / (2*c2))
+    a = np.exp(c0 - c2*(x0**2 + y0**2))
+    return a, x0, y0, sigma
+
+def _paley(q):
+    """
+    Returns the Paley Hadamard matrix of order q+1, q being a prime
+    with q % 4 == 3
+    """
+    squares = set((i * i) % q for i in range(1, q))
+    chi = np.array([0] + [1 if i in squares else -1 for i in range(1, q)])
+    idx = np.arange(q)
+    h = np.eye(q + 1)
+    h[0, 1:] += 1
+    h[1:, 0] -= 1
+    h[1:, 1:] += chi[(idx[None, :] - idx[:, None]) % q]
+    return h
+
+
+def _isprime(n):
+    return n > 1 and all(n % i for i in range(2, int(n**0.5) + 1))
+
+
+def hadamard(n):
+    """
+    Returns the Hadamard matrix of the smallest order with at least n
+    rows that is a Sylvester matrix (order power of 2), or the
+    Kronecker product of one and of a Paley matrix (e.g. 12, 20, 24).
+    Its first column is all ones, so that the others are zero-mean
+    """
+    order = max(int(n), 1)
+    while True:
+        sylvester = 1
+        while order % (2 * sylvester) == 0:
+            sylvester *= 2
+        paley = order // sylvester
+        # the power of 2 can also be split between the two matrices
+        while paley != 1 and not (paley % 4 == 0 and _isprime(paley - 1)) \
+                and sylvester > 1:
+            sylvester, paley = sylvester // 2, paley * 2
+        if paley == 1 or (paley % 4 == 0 and _isprime(paley - 1)):
+            break
+        order += 1
+    h = np.ones((1, 1))
+    while h.shape[0] < sylvester:
+        h = np.block([[h, h], [h, -h]])
+    if paley > 1:
+        h = np.kron(h, _paley(paley - 1))
+    # rows signs so that the first column is all ones
+    return h * h[:, :1]
+
 
 def make_filepath(name, fmt, basepath=None):
     """
@@ -140,23 +220,96 @@ def make_filepath(name, fmt, basepath=None):
                         datetime.utcnow().strftime(fmt).format(
                                             name=clean_txt(str(name))))
 
-def make_filepath_nostamp(name, fmt, basepath=None):
+def make_filepath_nostamp(name, fmt, basepath=None, latest=False):
     """
     Adds the fmt extension to name and join it to configuration dir
+
+    If latest, there is no such file, and name was saved with a
+    timestamp, the most recent of these files is returned instead
     """
+    from .library import get_library
     if basepath is None:
         basepath = PATHCONFIGFILE
-    name = clean_txt(str(name)) + os.path.splitext(fmt)[1]
-    return os.path.join(basepath, name)
+    name = clean_txt(str(name))
+    ext = os.path.splitext(fmt)[1]
+    path = os.path.join(basepath, name + ext)
+    if latest and not os.path.isfile(path):
+        stem = get_library(basepath).find(ext[1:], name)
+        if stem is not None:
+            path = os.path.join(basepath, stem + ext)
+    return path
 
 def list_filepath(fmt, basepath=None):
     """
     Returns a list of all files with same fmt extension, sorted
     with the timestamp
     """
+    from .library import get_library
+    if basepath is None:
+        basepath = PATHCONFIGFILE
+    return get_library(basepath).list(os.path.splitext(fmt)[1][1:])
+
+def latest_filepath(fmt, name=None, basepath=None):
+    """
+    Returns the most recent file with same fmt extension, saved with
+    name if not None, without extension, or None
+    """
+    from .library import get_library
     if basepath is None:
         basepath = PATHCONFIGFILE
-    pattern = "*" + os.path.splitext(fmt)[1]
-    names = glob.glob(os.path.join(basepath, pattern))
-    names = [os.path.split(os.path.splitext(item)[0])[1] for item in names]
-    return sorted(names, key=lambda x: x.rsplit('_', 1)[-1])
+    return get_library(basepath).latest(os.path.splitext(fmt)[1][1:], name)
+
+def index_filepath(path):
+    """
+    Records a file just saved in the library of its directory
+    """
+    from .library import get_library
+    get_library(os.path.dirname(path)).add(path)
+
+def unindex_filepath(path):
+    """
+    Removes a file just deleted from the library of its directory
+    """
+    from .library import get_library
+    get_library(os.path.dirname(path)).remove(path)
+
+def save_shape(name, arr):
+    """
+    Saves a (NSEGMENTS, 3) shape as a npz archive: the positions in
+    'pos', and the json metadata (mirror serial, number of segments,
+    position limits and date) as a string in 'meta'
+    """
+    meta = {'mirror': MIRRORNUM,
+            'nsegments': NSEGMENTS,
+            'limits': [PISTONMIN, PISTONMAX, TIPTILTMIN, TIPTILTMAX],
+            'date': datetime.utcnow().strftime('%Y%m%dT%H%M%S-%f')}
+    with open(name, 'wb') as f:
+        np.savez(f, pos=np.ascontiguousarray(arr, dtype=float), meta=json.dumps(meta))
+
+
+def load_shape(name):
+    """
+    Loads a shape file, npz or legacy text, and returns the
+    (NSEGMENTS, 3) read-only positions and the metadata dict (empty
+    for text files)
+
+    The shapes already loaded are kept in memory, and read again only
+    if their file changed. They are not memory-mapped: numpy cannot map
+    the arrays of a npz archive, and a shape is only NSEGMENTS*3 floats
+    """
+    stat = os.stat(name)
+    key = (stat.st_mtime, stat.st_size)
+    if name in _SHAPES and _SHAPES[name][0] == key:
+        return _SHAPES[name][1:]
+    with open(name, 'rb') as f:
+        magic = f.read(len(NPZMAGIC))
+    if magic == NPZMAGIC:
+        with np.load(name) as data:
+            pos = data['pos']
+            meta = json.loads(data['meta'].item())
+    else:
+        pos = np.loadtxt(name)
+        meta = {}
+    pos.flags.writeable = False
+    _SHAPES[name] = (key, pos, meta)
+    return pos, meta
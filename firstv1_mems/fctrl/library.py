@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  FIRSTCTRL - Pupil remapping control software
+#  Copyright (C) 2016  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import re
+import json
+from bisect import bisect_left, insort
+
+from . import core
+os = core.os
+datetime = core.datetime
+
+
+__all__ = ['FileLibrary', 'get_library']
+
+
+# timestamp added to the names by core.make_filepath
+STAMPFMT = '%Y%m%dT%H%M%S-%f'
+STAMPRE = re.compile(r'^\d{8}T\d{6}-\d{6}$')
+
+_libraries = {}
+
+
+def get_library(path):
+    """
+    Returns the library of the directory path, created on first use
+    """
+    path = os.path.abspath(path)
+    if path not in _libraries:
+        _libraries[path] = FileLibrary(path)
+    return _libraries[path]
+
+
+def split_stem(stem):
+    """
+    Splits a file name without extension into its name and timestamp,
+    the timestamp being '' if there is none
+    """
+    items = stem.rsplit('_', 1)
+    if len(items) == 2 and STAMPRE.match(items[1]):
+        return items[0], items[1]
+    return stem, ''
+
+
+class FileLibrary(object):
+    def __init__(self, path):
+        """
+        Index of the files saved in a directory, by type (the extension:
+        shape, shapeon, shapeoff, boxes...), name and timestamp
+
+        The index is kept in a json manifest in the directory, updated
+        on each save and delete. It is rebuilt from the directory
+        content whenever the directory changed since the manifest was
+        written: on the saves of new files, and when something else
+        modified it. The lookups in between only read the manifest
+
+        Args:
+          * path (str): the directory
+        """
+        self.path = path
+        self._manifest = os.path.join(self.path, core.LIBRARYFILENAME)
+        self._mtime = None
+        # kind -> sorted [(stamp, stem)]
+        self._files = {}
+        # (kind, name) -> sorted [(stamp, stem)]
+        self._names = {}
+
+    def _refresh(self):
+        """
+        Loads the manifest if it changed since the last read, or rebuilds
+        it if the directory changed since it was written
+        """
+        if not os.path.isdir(self.path):
+            self._files, self._names, self._mtime = {}, {}, None
+            return
+        dir_mtime = os.stat(self.path).st_mtime
+        if os.path.isfile(self._manifest):
+            mtime = os.stat(self._manifest).st_mtime
+            if dir_mtime <= mtime:
+                if mtime != self._mtime:
+                    try:
+                        with open(self._manifest, 'r') as f:
+                            self._build(json.load(f)['files'])
+                        self._mtime = mtime
+                        return
+                    except (IOError, OSError, KeyError, ValueError):
+                        pass
+                else:
+                    return
+        self.rebuild()
+
+    def _build(self, files):
+        self._files, self._names = {}, {}
+        for item in files:
+            self._insert(item)
+
+    def _insert(self, filename):
+        stem, ext = os.path.splitext(filename)
+        name, stamp = split_stem(stem)
+        insort(self._files.setdefault(ext[1:], []), (stamp, stem))
+        insort(self._names.setdefault((ext[1:], name), []), (stamp, stem))
+
+    def _write(self):
+        files = [stem + '.' + kind for kind, items in self._files.items()
+                                    for stamp, stem in items]
+        try:
+            # in place, a new file would change the directory mtime
+            with open(self._manifest, 'w') as f:
+                json.dump({'files': sorted(files)}, f)
+            self._mtime = os.stat(self._manifest).st_mtime
+        except (IOError, OSError):
+            self._mtime = None
+
+    def rebuild(self):
+        """
+        Rebuilds the manifest from the content of the directory
+        """
+        files = [item for item in os.listdir(self.path)
+                    if os.path.isfile(os.path.join(self.path, item))
+                        and os.path.splitext(item)[1] != ''
+                        and item != core.LIBRARYFILENAME]
+        self._build(files)
+        self._write()
+
+    def add(self, filepath):
+        """
+        Adds a file just saved in the directory to the manifest
+        """
+        # a file created changes the directory: the manifest is rebuilt,
+        # with the files added by something else meanwhile
+        self._refresh()
+        filename = os.path.basename(filepath)
+        stem, ext = os.path.splitext(filename)
+        items = self._files.get(ext[1:], [])
+        idx = bisect_left(items, (split_stem(stem)[1], stem))
+        if idx == len(items) or items[idx][1] != stem:
+            self._insert(filename)
+        self._write()
+
+    def remove(self, filepath):
+        """
+        Removes a file just deleted from the manifest
+        """
+        self._refresh()
+        stem, ext = os.path.splitext(os.path.basename(filepath))
+        name, stamp = split_stem(stem)
+        for items in (self._files.get(ext[1:], []), self._names.get((ext[1:], name), [])):
+            if (stamp, stem) in items:
+                items.remove((stamp, stem))
+        self._write()
+
+    def list(self, kind):
+        """
+        Returns the names, without extension, of the files of this kind
+        sorted with the timestamp
+        """
+        self._refresh()
+        return [stem for stamp, stem in self._files.get(kind, [])]
+
+    def latest(self, kind, name=None):
+        """
+        Returns the name, without extension, of the most recent file of
+        this kind, and saved with this name if not None, or None
+        """
+        self._refresh()
+        if name is None:
+            items = self._files.get(kind, [])
+        else:
+            items = self._names.get((kind, name), [])
+        if len(items) == 0:
+            return None
+        return items[-1][1]
+
+    def find(self, kind, name):
+        """
+        Returns the name, without extension, of the file of this kind
+        with this full name, or else the most recent one saved with this
+        name and a timestamp, or None
+        """
+        self._refresh()
+        stem_name, stamp = split_stem(name)
+        items = self._names.get((kind, stem_name), [])
+        idx = bisect_left(items, (stamp, name))
+        if idx < len(items) and items[idx] == (stamp, name):
+            return name
+        return self.latest(kind, name)
+
+    def between(self, kind, since=None, until=None, name=None):
+        """
+        Returns the names, without extension, of the files of this kind
+        saved between two dates, sorted with the timestamp
+
+        Args:
+          * since (datetime, str or None): UTC date from which to search,
+            included, as datetime or 'YYYYmmdd[THHMMSS]'
+          * until (datetime, str or None): UTC date up to which to search,
+            excluded
+          * name (str or None): the name the files were saved with
+        """
+        self._refresh()
+        if name is None:
+            items = self._files.get(kind, [])
+        else:
+            items = self._names.get((kind, name), [])
+        if isinstance(since, datetime):
+            since = since.strftime(STAMPFMT)
+        if isinstance(until, datetime):
+            until = until.strftime(STAMPFMT)
+        start = 0 if since is None else bisect_left(items, (since,))
+        stop = len(items) if until is None else bisect_left(items, (until,))
+        return [stem for stamp, stem in items[start:stop]]
@@ -26,8 +26,9 @@
 
 
 import astropy.io.fits as pf
-import andorsdk
 import matplotlib.pyplot as plt
+from threading import Thread
+from collections import deque
 plt.ion()
 from . import core
 np = core.np
@@ -35,8 +36,9 @@ time = core.time
 os = core.os
 Patiencebar = core.Patiencebar
 from .mems import Mems
-from .camera import Camera
+from .andor import Andor, FrameGrabber
 from .boxcal import BoxCal
+from .optistore import OptiStore
 
 
 __all__ = ['Loop']
@@ -46,19 +48,34 @@ class Loop(object):
     _boxcal = BoxCal(nfib=len(core.FIRSTSEGS), with_cam=False)
 
     def __init__(self):
-        print("Initializing Andor Camera .... ") 
-        self.cam = andorsdk.Andor()
+        print("Initializing Andor Camera .... ")
+        # same camera start-up as AndorCtrl: the andorsdk module is not
+        # shipped, and the FrameGrabber needs andor.Andor
+        self.cam = Andor()
 
         print("Cooling down the detector...")
-        self.cam.Temperature.setpoint = core.CAMERATEMP  # start cooling
-        self.cam.Temperature.cooler = core.CAMERACOOLING
-        self.camsize = self.cam.Detector.size
+        self.cam.SetTemperature(core.CAMERATEMP)  # start cooling
+        if core.CAMERACOOLING:
+            self.cam.CoolerON()
         #self.cam.exposure = core.DEFAULTEXPOSURETIME  # ms
-	self.cam.exposure = 20  # ms
-        self.cam.Acquire.Single()
-        self.camsize = self.cam.Detector.size
+        self.cam.exposure = 20  # ms
+        self.cam.SetExposureTime(self.cam.exposure * 1e-3)
+        self.cam.SetVideoScan()
+        self.cam.StartAcquisition()
+        # frames are pulled in the background, and paired to the mems
+        # commands by their timestamps
+        self.grabber = FrameGrabber(self.cam)
+        self.grabber.start()
+        self.camsize = (self.cam.width, self.cam.height)
         self._dark = np.zeros(self.camsize).astype(np.int16)
 
+        self._tracking = False
+        self._track_thread = None
+        # (time, tip, tilt, flux) of each tracking correction
+        self.track_history = deque(maxlen=core.TRACKHISTORY)
+        # history of the optimization results
+        self.store = OptiStore()
+
         self.mems = Mems()
         # get connection
         self.mems.connect()
@@ -103,8 +120,10 @@ class Loop(object):
         """
         Exits everything
         """
+        self.track_stop()
         self.mems.exit()
-        self.cam.shutdown()
+        self.grabber.stop()
+        self.cam.ShutDown()
 
     def boxes_load(self, name):
         """
@@ -161,7 +180,11 @@ class Loop(object):
         current video stream
         """
         #self._dark = self.cam.Acquire.snap().astype(np.int16)
-        self._dark = self.cam.Acquire.snap().astype(np.int16).reshape((496,658)).T
+        frame = self.grabber.first_after(time.time(), timeout=core.FRAMETIMEOUT)
+        if frame is None:
+            print("No frame from the camera")
+            return
+        self._dark = frame[3].T
 
     def rm_dark(self):
         """
@@ -197,6 +220,9 @@ class Loop(object):
           * segments optimized
           * flux values as a 3D array [tip, tilt, segment]
         """
+        if self._tracking:
+            print("The tracking is running, use track_stop first. Done.")
+            return
         if not self.mems.connected:
             self.mems.connect()
         self.mems.flat()
@@ -214,41 +240,516 @@ class Loop(object):
         tip = np.arange(minmaxtip[0], minmaxtip[1]*(1+1e-8), tiptiltsteps[0])
         tilt = np.arange(minmaxtilt[0], minmaxtilt[1]*(1+1e-8), tiptiltsteps[1])
         pb = Patiencebar(valmax=tip.size*tilt.size, barsize=50, title="Optimization...")
+        # all segments of elm go through the same grid, tip-major
+        tips = np.repeat(np.repeat(tip, tilt.size)[:, None], sz, axis=1)
+        tilts = np.repeat(np.tile(tilt, tip.size)[:, None], sz, axis=1)
+        fluxes, times = self._scan(elm, tips, tilts, pb=pb)
+        if fluxes is None:
+            self.mems.flat()
+            return
         # empty result array
         NS = len(core.FIRSTSEGS)
         res = np.zeros((tip.size, tilt.size, NS))
-        for tip_idx, tip_i in enumerate(tip):
-            for tilt_idx, tilt_i in enumerate(tilt):
-                self.mems.set_pos(elm, tip=[tip_i]*NS, tilt=[tilt_i]*NS)
-                time.sleep(core.MEMSLAG)
-                #img = self.cam.Acquire.snap().astype(np.int16)
-                img = self.cam.Acquire.snap().astype(np.int16).reshape((496,658)).T
-                time.sleep(core.IMGLAG)
-                res[tip_idx, tilt_idx] = self._extract_fluxes(elm, img=img - self.dark)
-                pb.update()
+        res[:, :, [core.FIRSTSEGS.index(seg) for seg in elm]] = \
+                                    fluxes.reshape((tip.size, tilt.size, sz))
         self.mems.flat()
         self.show_opti(tip,tilt,elm,res)
         self.mems.set_current_as_on()
-        self.mems.shape_on_save('Optimizer_On_CHECK')
-        np.save('LatestOptimizerResults_Tip',tip)
-        np.save('LatestOptimizerResults_Tilt',tilt)
-        np.save('LatestOptimizerResults_Tip',elm)
-        np.save('LatestOptimizerResults_Tip',res)
+        shape = self.mems.shape_on_save('Optimizer_On_CHECK')
+        # best point of each segment
+        flux = fluxes.max(axis=0)
+        best_tip, best_tilt = tips[fluxes.argmax(axis=0), 0], tilts[fluxes.argmax(axis=0), 0]
+        self.store.add('raster', elm, best_tip, best_tilt, flux, shape=shape,
+                       tip=tip, tilt=tilt, fluxes=res, times=times)
 
 
 
 
         #return tip, tilt, elm, res
 
+    def optimization_parallel(self, elm='first', dither=0.1, width=0.5,
+                                    gain=0.7, niter=10, tol=0.01):
+        """
+        Carries the injection optimization of all segments at once,
+        each one following its own tip-tilt dithering pattern around
+        its current position
+
+        The patterns are the columns of a Hadamard matrix, so that the
+        flux changes due to the tip and tilt of each segment can be
+        demodulated separately in each fiber box. The gradient of the
+        log-flux then gives the step towards the peak, as for a
+        gaussian injection profile of the given width
+
+        Each iteration takes one frame per row of the Hadamard matrix,
+        i.e. 2*nelm+1 rounded up to the next available order (20 for
+        the 9 segments of FIRST)
+
+        Input argument elm can be:
+          * int -> 1 segment
+          * list of int -> n segment
+          * 'first' -> the first segments
+
+        Others args:
+          * dither (float): amplitude of the dithering in tip and tilt
+          * width (float): gaussian sigma of the injection profile, in
+            tip-tilt units
+          * gain (float): fraction of the estimated step applied at
+            each iteration
+          * niter (int): max number of iterations
+          * tol (float): stops when all steps are smaller than tol
+
+        Returns:
+          * segments optimized
+          * tip and tilt values at each iteration, as (niter, nelm)
+            arrays
+          * mean flux values at each iteration, as a (niter, nelm)
+            array
+        """
+        if self._tracking:
+            print("The tracking is running, use track_stop first. Done.")
+            return
+        if not self.mems.connected:
+            self.mems.connect()
+        elm, sz = self.mems._clean_segment(elm)
+        if elm is None:
+            print('There is an issue with how you wrote your elm input. Done.')
+            return
+        for i in elm:
+            if i not in core.FIRSTSEGS:
+                print("Segment '{}' is not a FIRST segment. Done.".format(i))
+                return
+        # one tip and one tilt pattern per segment, all orthogonal to
+        # each other and to the mean
+        codes = core.hadamard(2*sz + 1)[:, 1:2*sz + 1]
+        tip, tilt = self.mems._pos[core.mask_elm(elm), 1:].T.copy()
+        hist_tip, hist_tilt, hist_flux = [], [], []
+        nframes = 0
+        pb = Patiencebar(valmax=niter, barsize=50, title="Optimization...")
+        for it in range(niter):
+            res = self._dither_gradient(elm, tip, tilt, codes, dither)
+            if res is None:
+                break
+            flux, grad_tip, grad_tilt = res
+            nframes += codes.shape[0]
+            step_tip = np.clip(gain * width**2 / dither * grad_tip, -width, width)
+            step_tilt = np.clip(gain * width**2 / dither * grad_tilt, -width, width)
+            hist_tip.append(tip.copy())
+            hist_tilt.append(tilt.copy())
+            hist_flux.append(flux)
+            tip = np.clip(tip + step_tip, core.TIPTILTMIN, core.TIPTILTMAX)
+            tilt = np.clip(tilt + step_tilt, core.TIPTILTMIN, core.TIPTILTMAX)
+            pb.update()
+            if max(np.abs(step_tip).max(), np.abs(step_tilt).max()) < tol:
+                break
+        self.mems.set_pos(elm, tip=tip, tilt=tilt)
+        for idx, seg in enumerate(elm):
+            print("#{:d} - tip: {:.3f}, tilt: {:.3f}".format(seg, tip[idx], tilt[idx]))
+        print("{:d} iterations, {:d} frames".format(len(hist_flux), nframes))
+        self.mems.set_current_as_on()
+        shape = self.mems.shape_on_save('Optimizer_On_CHECK')
+        hist_tip, hist_tilt, hist_flux = np.array(hist_tip), np.array(hist_tilt), np.array(hist_flux)
+        flux = hist_flux[-1] if len(hist_flux) > 0 else np.zeros(sz)
+        self.store.add('parallel', elm, tip, tilt, flux, shape=shape,
+                       tip=hist_tip, tilt=hist_tilt, fluxes=hist_flux, nframes=nframes)
+        return elm, hist_tip, hist_tilt, hist_flux
+
+    def track_start(self, elm='first', dither=0.02, width=0.5, gain=0.1,
+                          period=1.):
+        """
+        Starts tracking the injection peak of the segments in the
+        background, until track_stop
+
+        Each correction dithers the segments around their current
+        positions with the patterns of optimization_parallel, and
+        moves them by a small step towards the peak. The history of
+        the corrections is kept in track_history
+
+        Input argument elm can be:
+          * int -> 1 segment
+          * list of int -> n segment
+          * 'first' -> the first segments
+
+        Others args:
+          * dither (float): amplitude of the dithering in tip and tilt
+          * width (float): gaussian sigma of the injection profile, in
+            tip-tilt units
+          * gain (float): fraction of the estimated step applied at
+            each correction, at most dither
+          * period (float): time between two corrections, in s
+        """
+        if self._tracking:
+            print("The tracking is already running")
+            return
+        if not self.mems.connected:
+            self.mems.connect()
+        elm, sz = self.mems._clean_segment(elm)
+        if elm is None:
+            print('There is an issue with how you wrote your elm input. Done.')
+            return
+        for i in elm:
+            if i not in core.FIRSTSEGS:
+                print("Segment '{}' is not a FIRST segment. Done.".format(i))
+                return
+        self._tracking = True
+        self._track_thread = Thread(target=self._track,
+                                    args=(elm, dither, width, gain, period))
+        self._track_thread.daemon = True
+        self._track_thread.start()
+        print("Tracking segments {}".format(elm))
+
+    def track_stop(self):
+        """
+        Stops the tracking, and leaves the segments at their last
+        corrected positions
+        """
+        if not self._tracking:
+            return
+        self._tracking = False
+        self._track_thread.join()
+        print("Tracking stopped")
+
+    def _track(self, elm, dither, width, gain, period):
+        sz = len(elm)
+        codes = core.hadamard(2*sz + 1)[:, 1:2*sz + 1]
+        try:
+            while self._tracking:
+                t0 = time.time()
+                # the other commands to the mems wait for the correction
+                with self.mems._lock:
+                    tip, tilt = self.mems._pos[core.mask_elm(elm), 1:].T.copy()
+                    res = self._dither_gradient(elm, tip, tilt, codes, dither)
+                    if res is None:
+                        # back to the positions before the dithering
+                        self.mems.set_pos(elm, tip=tip, tilt=tilt)
+                    else:
+                        flux, grad_tip, grad_tilt = res
+                        tip = tip + np.clip(gain * width**2 / dither * grad_tip, -dither, dither)
+                        tilt = tilt + np.clip(gain * width**2 / dither * grad_tilt, -dither, dither)
+                        tip = np.clip(tip, core.TIPTILTMIN, core.TIPTILTMAX)
+                        tilt = np.clip(tilt, core.TIPTILTMIN, core.TIPTILTMAX)
+                        self.mems.set_pos(elm, tip=tip, tilt=tilt)
+                if res is None:
+                    time.sleep(period)
+                    continue
+                self.track_history.append((t0, tip, tilt, flux))
+                time.sleep(max(0, period - (time.time() - t0)))
+        except Exception as e:
+            print("Tracking stopped on error: {}".format(e))
+        finally:
+            self._tracking = False
+
+    def _dither_gradient(self, elm, tip, tilt, codes, dither):
+        """
+        Scans the segments elm through the tip-tilt dithering patterns
+        around (tip, tilt). codes holds the tip patterns of the segments
+        in its first nelm columns, and the tilt patterns in the next ones
+
+        Returns the mean fluxes, and the gradients of the log-flux in
+        tip and tilt (times dither) demodulated in each box, or None if
+        the camera stopped sending frames
+        """
+        sz = len(elm)
+        code_tip, code_tilt = codes[:, :sz], codes[:, sz:2*sz]
+        fluxes, times = self._scan(elm, tip + dither*code_tip,
+                                   tilt + dither*code_tilt)
+        if fluxes is None:
+            return None
+        logflux = np.log(np.clip(fluxes, 1, None))
+        return (fluxes.mean(axis=0), (code_tip * logflux).mean(axis=0),
+                (code_tilt * logflux).mean(axis=0))
+
+    def optimization_adaptive(self, elm='first', minmaxtip=(-2, 2),
+                                    minmaxtilt=(-2, 2), ncoarse=(5, 5),
+                                    nfine=3, nrefine=3, shrink=0.4):
+        """
+        Carries the injection optimization with a coarse grid, followed
+        by finer grids centered on the peak of each segment
+
+        The peak is found by fitting a gaussian (core.gaussPt) to the
+        fluxes measured around the best point, and each refinement
+        shrinks the fine grid. All segments are scanned at once, each
+        one on its own fine grid
+
+        Input argument elm can be:
+          * int -> 1 segment
+          * list of int -> n segment
+          * 'first' -> the first segments
+
+        Others args:
+          * minmaxtip (list of 2 floats): min-max range in tip
+          * minmaxtilt (list of 2 floats): min-max range in tilt
+          * ncoarse (list of 2 int): number of coarse steps in tip and
+            tilt
+          * nfine (int): number of fine steps in tip and tilt
+          * nrefine (int): number of refinements
+          * shrink (float): size ratio of two successive fine grids
+
+        Returns:
+          * segments optimized
+          * best tip and tilt values, as two (nelm,) arrays
+          * tip, tilt and flux values explored, as (npoints, nelm)
+            arrays
+        """
+        if self._tracking:
+            print("The tracking is running, use track_stop first. Done.")
+            return
+        if not self.mems.connected:
+            self.mems.connect()
+        self.mems.flat()
+        elm, sz = self.mems._clean_segment(elm)
+        if elm is None:
+            print('There is an issue with how you wrote your elm input. Done.')
+            return
+        for i in elm:
+            if i not in core.FIRSTSEGS:
+                print("Segment '{}' is not a FIRST segment. Done.".format(i))
+                return
+        pb = Patiencebar(valmax=np.prod(ncoarse) + nrefine*nfine**2,
+                         barsize=50, title="Optimization...")
+        res = self._adaptive_search(elm, minmaxtip, minmaxtilt, ncoarse, nfine,
+                                    nrefine, shrink, pb=pb)
+        if res is None:
+            self.mems.flat()
+            return
+        best_tip, best_tilt, tips, tilts, fluxes = res
+        self.mems.set_pos(elm, tip=best_tip, tilt=best_tilt)
+        for idx, seg in enumerate(elm):
+            print("#{:d} - tip: {:.3f}, tilt: {:.3f}".format(seg, best_tip[idx], best_tilt[idx]))
+        self.mems.set_current_as_on()
+        shape = self.mems.shape_on_save('Optimizer_On_CHECK')
+        self.store.add('adaptive', elm, best_tip, best_tilt, fluxes.max(axis=0),
+                       shape=shape, tip=tips, tilt=tilts, fluxes=fluxes)
+        return elm, best_tip, best_tilt, tips, tilts, fluxes
+
+    def optimization_warm(self, elm='first', span=0.2, nfine=3, nrefine=2,
+                                shrink=0.4, threshold=0.5, minmaxtip=(-2, 2),
+                                minmaxtilt=(-2, 2), ncoarse=(5, 5)):
+        """
+        Carries the injection optimization starting from the latest
+        shape ON saved
+
+        The fluxes are measured at the latest optimum. The segments
+        whose flux is still above threshold times the flux of their
+        latest optimization (see store) are refined on small grids
+        around their latest optimum. The others, and all segments if
+        no shape ON was saved, go through the full adaptive search
+
+        Input argument elm can be:
+          * int -> 1 segment
+          * list of int -> n segment
+          * 'first' -> the first segments
+
+        Others args:
+          * span (float): half-size of the first fine grid in tip and
+            tilt
+          * nfine (int): number of fine steps in tip and tilt
+          * nrefine (int): number of refinements
+          * shrink (float): size ratio of two successive fine grids
+          * threshold (float): fraction of the latest optimal flux under
+            which a segment is searched again on the full range
+          * minmaxtip, minmaxtilt, ncoarse: the full search parameters,
+            see optimization_adaptive
+
+        Returns:
+          * segments optimized
+          * best tip and tilt values, as two (nelm,) arrays
+          * segments that needed the full search
+        """
+        if self._tracking:
+            print("The tracking is running, use track_stop first. Done.")
+            return
+        if not self.mems.connected:
+            self.mems.connect()
+        elm, sz = self.mems._clean_segment(elm)
+        if elm is None:
+            print('There is an issue with how you wrote your elm input. Done.')
+            return
+        for i in elm:
+            if i not in core.FIRSTSEGS:
+                print("Segment '{}' is not a FIRST segment. Done.".format(i))
+                return
+        if self.mems.load_latest_shape() is None:
+            print("No shape ON saved, full search instead")
+            res = self.optimization_adaptive(elm, minmaxtip=minmaxtip, minmaxtilt=minmaxtilt,
+                                             ncoarse=ncoarse, nfine=nfine, nrefine=nrefine,
+                                             shrink=shrink)
+            if res is None:
+                return
+            return res[0], res[1], res[2], elm
+        # fluxes at the latest optimum
+        self.mems.on(elm)
+        best_tip, best_tilt = self.mems._on[core.mask_elm(elm), 1:].T.copy()
+        frame = self.grabber.first_after(time.time() + core.MEMSLAG + self.grabber.cycletime,
+                                         timeout=core.FRAMETIMEOUT)
+        if frame is None:
+            print("No frame from the camera. Done.")
+            return
+        start_flux = self._extract_fluxes(elm, img=frame[3].T - self.dark)
+        ref_flux = np.zeros(sz)
+        for idx, seg in enumerate(elm):
+            best = self.store.best(seg)
+            if best is not None:
+                ref_flux[idx] = best[2]
+        lost = start_flux < threshold * ref_flux
+        warm = np.logical_not(lost)
+        warm_elm = [seg for idx, seg in enumerate(elm) if warm[idx]]
+        lost_elm = [seg for idx, seg in enumerate(elm) if lost[idx]]
+        best_flux = start_flux.astype(float)
+        pb = Patiencebar(valmax=nrefine*nfine**2 + (np.prod(ncoarse) + nrefine*nfine**2)*(len(lost_elm) > 0),
+                         barsize=50, title="Optimization...")
+        if len(warm_elm) > 0:
+            nowhere = np.zeros((0, len(warm_elm)))
+            res = self._refine(warm_elm, best_tip[warm], best_tilt[warm],
+                               np.array([span, span]), nfine, nrefine, shrink,
+                               nowhere, nowhere, nowhere, pb=pb)
+            best_tip[warm], best_tilt[warm] = res[0], res[1]
+            if res[4].shape[0] > 0:
+                best_flux[warm] = res[4].max(axis=0)
+        if len(lost_elm) > 0:
+            print("Full search for segments {}".format(lost_elm))
+            res = self._adaptive_search(lost_elm, minmaxtip, minmaxtilt, ncoarse,
+                                        nfine, nrefine, shrink, pb=pb)
+            if res is not None:
+                best_tip[lost], best_tilt[lost] = res[0], res[1]
+                best_flux[lost] = res[4].max(axis=0)
+        self.mems.set_pos(elm, tip=best_tip, tilt=best_tilt)
+        for idx, seg in enumerate(elm):
+            print("#{:d} - tip: {:.3f}, tilt: {:.3f}".format(seg, best_tip[idx], best_tilt[idx]))
+        self.mems.set_current_as_on()
+        shape = self.mems.shape_on_save('Optimizer_On_CHECK')
+        self.store.add('warm', elm, best_tip, best_tilt, best_flux, shape=shape,
+                       start_flux=start_flux, ref_flux=ref_flux, lost=lost)
+        return elm, best_tip, best_tilt, lost_elm
+
+    def _adaptive_search(self, elm, minmaxtip, minmaxtilt, ncoarse, nfine,
+                               nrefine, shrink, pb=None):
+        """
+        Scans the coarse grid, and refines around the peak of each
+        segment, see optimization_adaptive
+
+        Returns the best tip and tilt, and the tip, tilt and flux
+        values explored, or None if the camera stopped sending frames
+        """
+        sz = len(elm)
+        minmaxtip = sorted(list(map(float, minmaxtip[:2])))
+        minmaxtilt = sorted(list(map(float, minmaxtilt[:2])))
+        tip = np.linspace(minmaxtip[0], minmaxtip[1], int(ncoarse[0]))
+        tilt = np.linspace(minmaxtilt[0], minmaxtilt[1], int(ncoarse[1]))
+        # coarse grid, the same for all segments
+        tips = np.repeat(np.repeat(tip, tilt.size)[:, None], sz, axis=1)
+        tilts = np.repeat(np.tile(tilt, tip.size)[:, None], sz, axis=1)
+        fluxes, times = self._scan(elm, tips, tilts, pb=pb)
+        if fluxes is None:
+            return None
+        # half-size of the fine grid
+        span = np.array([np.ptp(tip), np.ptp(tilt)]) / (np.array(ncoarse) - 1).clip(1)
+        best = np.argmax(fluxes, axis=0)
+        best_tip, best_tilt = tips[best, range(sz)], tilts[best, range(sz)]
+        best_tip, best_tilt = self._fit_peaks(tips, tilts, fluxes, best_tip,
+                                              best_tilt, 1.5*span)
+        return self._refine(elm, best_tip, best_tilt, span, nfine, nrefine,
+                            shrink, tips, tilts, fluxes, pb=pb)
+
+    def _refine(self, elm, best_tip, best_tilt, span, nfine, nrefine, shrink,
+                      tips, tilts, fluxes, pb=None):
+        """
+        Scans fine grids centered on the peak of each segment, fits the
+        peaks again with all the points near them, and shrinks the
+        grids, nrefine times
+
+        Returns the best tip and tilt, and the tip, tilt and flux
+        values explored, including the ones given
+        """
+        offsets = np.linspace(-1, 1, int(nfine))
+        for it in range(nrefine):
+            # fine grids, centered on each segment's peak
+            fine_tips = np.clip(best_tip + np.repeat(offsets, offsets.size)[:, None]*span[0],
+                                core.TIPTILTMIN, core.TIPTILTMAX)
+            fine_tilts = np.clip(best_tilt + np.tile(offsets, offsets.size)[:, None]*span[1],
+                                 core.TIPTILTMIN, core.TIPTILTMAX)
+            fine_fluxes, times = self._scan(elm, fine_tips, fine_tilts, pb=pb)
+            if fine_fluxes is None:
+                break
+            tips = np.concatenate((tips, fine_tips))
+            tilts = np.concatenate((tilts, fine_tilts))
+            fluxes = np.concatenate((fluxes, fine_fluxes))
+            best_tip, best_tilt = self._fit_peaks(tips, tilts, fluxes, best_tip,
+                                                  best_tilt, 1.5*span)
+            span = span * shrink
+        best_tip = np.clip(best_tip, core.TIPTILTMIN, core.TIPTILTMAX)
+        best_tilt = np.clip(best_tilt, core.TIPTILTMIN, core.TIPTILTMAX)
+        return best_tip, best_tilt, tips, tilts, fluxes
+
+    def _fit_peaks(self, tips, tilts, fluxes, tip0, tilt0, span):
+        """
+        Fits a gaussian to the fluxes of each segment, using the points
+        within span of (tip0, tilt0), and returns the peak positions.
+        The best point is kept for the segments where the fit fails or
+        falls out of the points used
+        """
+        best_tip, best_tilt = tip0.copy(), tilt0.copy()
+        for idx in range(fluxes.shape[1]):
+            near = (np.abs(tips[:, idx] - tip0[idx]) <= span[0]*(1+1e-8)) \
+                    & (np.abs(tilts[:, idx] - tilt0[idx]) <= span[1]*(1+1e-8))
+            x, y, f = tips[near, idx], tilts[near, idx], fluxes[near, idx]
+            # the best point so far, if the fit fails
+            best_tip[idx], best_tilt[idx] = x[f.argmax()], y[f.argmax()]
+            fit = core.fit_gaussPt(x, y, f - min(f.min(), 0))
+            if fit is None:
+                continue
+            a, x0, y0, sigma = fit
+            if x.min() <= x0 <= x.max() and y.min() <= y0 <= y.max():
+                best_tip[idx], best_tilt[idx] = x0, y0
+        return best_tip, best_tilt
+
+    def _scan(self, elm, tips, tilts, pb=None):
+        """
+        Moves the segments elm through the (tip, tilt) positions given
+        as two (npoints, nelm) arrays
+
+        Each point is paired with the first frame whose exposure
+        started after the mems settled (MEMSLAG after the command).
+        The next command is sent as soon as that frame is read out,
+        and the fluxes are extracted while the mems settles
+
+        Returns:
+          * the fluxes as a (npoints, nelm) array, or None if the
+            camera stopped sending frames
+          * the readout times of the frames paired to the points
+        """
+        npts = len(tips)
+        fluxes = np.zeros((npts, len(elm)))
+        times = np.zeros(npts)
+        frame = np.zeros((self.cam.height, self.cam.width), dtype=np.int32)
+        # the exposure of a frame starts about one cycle before its readout.
+        # The grabber owns the sdk calls and keeps the cycle time
+        cycle = self.grabber.cycletime
+        self.mems.set_pos(elm, tip=tips[0], tilt=tilts[0])
+        settled = time.time() + core.MEMSLAG
+        for idx in range(npts):
+            res = self.grabber.first_after(settled + cycle, out=frame,
+                                           timeout=core.FRAMETIMEOUT)
+            if res is None:
+                print("No frame from the camera. Done.")
+                return None, None
+            times[idx] = res[2]
+            if idx + 1 < npts:
+                self.mems.set_pos(elm, tip=tips[idx + 1], tilt=tilts[idx + 1])
+                settled = time.time() + core.MEMSLAG
+            fluxes[idx] = self._extract_fluxes(elm, img=frame.T - self.dark)
+            if pb is not None:
+                pb.update()
+        return fluxes, times
+
     def show_opti(self, tip, tilt, elm, fluxes):
         """
         Just give all inputs as optimization puked them
         """
         #for idx, seg in enumerate(segs):
-	plt.subplot(3,3,1)
+        plt.subplot(3,3,1)
         id_plt=1
         for idx, seg in enumerate(core.FIRSTSEGS):
-	    plt.subplot(3,3,id_plt)
+            plt.subplot(3,3,id_plt)
             plt.matshow(fluxes[:,:,idx], origin='lower',fignum=0)
             plt.title('#'+str(seg))
             y,x = np.unravel_index(fluxes[:,:,idx].argmax(),
@@ -256,24 +757,18 @@ class Loop(object):
             print("#{:d} - tip: {:.3f}, tilt: {:.3f}".format(seg,tip[y], tilt[x]))
             id_plt+=1
             for i in elm:
-        	self.mems.set_pos(seg,0,tip[y],tilt[x])
+                self.mems.set_pos(seg,0,tip[y],tilt[x])
 
 
 
 
     def _extract_fluxes(self, elm, img):
         """
-        Extracts the injection-blob flux values from a camera image
+        Extracts the injection-blob flux values from a camera image, or
+        from a cube of images, in the order of elm
         """
-        fluxes = []
-        for idx, seg in enumerate(core.FIRSTSEGS):
-            if seg not in elm:
-                continue
-            box_y, box_x = self._boxcal.boxes[idx]
-            # sums the flux in the box and appends to output
-            #fluxes.append(dataimg[box_y, box_x].sum())
-            fluxes.append(img[box_y, box_x].sum())
-        return fluxes
+        sums = self._boxcal.extract(img)[0]
+        return sums[..., [core.FIRSTSEGS.index(seg) for seg in elm]]
 
 
 
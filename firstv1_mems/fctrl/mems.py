@@ -25,6 +25,10 @@
 ###############################################################################
 
 
+from contextlib import contextmanager
+from functools import wraps
+from threading import RLock
+
 from . import core
 os = core.os
 np = core.np
@@ -34,6 +38,17 @@ IrisAO_API = core.IrisAO_API
 
 __all__ = ['Mems']
 
+
+def _locked(func):
+    # the mems is used by one thread at a time, e.g. the tracking of
+    # Loop and the user
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
 class Mems(object):
     def __init__(self):
         self._INITIALDIR = os.getcwd()
@@ -41,6 +56,11 @@ class Mems(object):
         self._pos = np.zeros((core.NSEGMENTS, 3))
         self._off = np.c_[np.zeros((core.NSEGMENTS,1)),np.ones((core.NSEGMENTS, 2))*core.TIPTILTMIN]
         self._on = np.zeros((core.NSEGMENTS, 3))
+        # segments staged by set_pos within a batch
+        self._batch_depth = 0
+        self._staged = set()
+        # held by the commands sent to the mems, and by the batches
+        self._lock = RLock()
 
     def __enter__(self):
         return self
@@ -50,6 +70,7 @@ class Mems(object):
 
     __exit__ = __del__
 
+    @_locked
     def connect(self):
         """
         Connects to the Mems
@@ -58,7 +79,8 @@ class Mems(object):
         if self._connected:
             return
         # hack to CD to the folder with the cal files
-        os.chdir(core.PATHCALMEMS)
+        if not core.MEMSSIMULATED:
+            os.chdir(core.PATHCALMEMS)
         disableHardware = False
         self._mirror = IrisAO_API.MirrorConnect(core.MIRRORNUM,
                                                 core.DRIVERNUM,
@@ -67,6 +89,7 @@ class Mems(object):
         os.chdir(self._INITIALDIR)
         self._connected = True
 
+    @_locked
     def disconnect(self):
         """
         Disconnects the Mems
@@ -114,6 +137,7 @@ class Mems(object):
     def first_seg(self, value):
         print('Read-only')
         
+    @_locked
     def flat(self):
         """
         Sets all tip, tilt, piston to nil
@@ -163,6 +187,7 @@ class Mems(object):
             return None, None
         return elm, len(elm)
 
+    @_locked
     def get_pos(self, elm):
         """
         Gets the positions of the mems segments
@@ -186,6 +211,7 @@ class Mems(object):
         return np.asarray(IrisAO_API.\
                   GetMirrorPosition(self._mirror, elm)[0]).T
 
+    @_locked
     def set_pos(self, elm, piston=None, tip=None, tilt=None):
         """
         Sets the positions of the mems segments
@@ -240,20 +266,71 @@ class Mems(object):
 
         new_val = np.vstack((piston, tip, tilt)).T
         self._pos[core.mask_elm(elm),:] = new_val
+        if self._batch_depth > 0:
+            # sent all at once at the end of the batch
+            self._staged.update(elm)
+            return
         new_val = [tuple(item) for item in new_val]
         # replace in local values
         IrisAO_API.SetMirrorPosition(self._mirror, elm, new_val)
         IrisAO_API.MirrorCommand(self._mirror, IrisAO_API.MirrorSendSettings)
 
+    @contextmanager
+    def batch(self):
+        """
+        Stages all the set_pos calls made in the with-block and sends
+        them to the mems in a single update when leaving it. If an error
+        occurs in the block, nothing is sent. The other threads cannot
+        use the mems meanwhile
+
+        ex: with m.batch():
+                m.set_pos(15, 0, 3, 3)
+                m.set_pos(19, 0, 3, 3)
+        """
+        with self._lock:
+            if self._batch_depth == 0:
+                backup = self._pos.copy()
+            self._batch_depth += 1
+            success = False
+            try:
+                yield self
+                success = True
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    if success:
+                        self._flush()
+                    else:
+                        self._pos = backup
+                        self._staged.clear()
+
+    @_locked
+    def _flush(self):
+        """
+        Sends the staged segments positions to the mems
+        """
+        elm = sorted(self._staged)
+        self._staged.clear()
+        if len(elm) == 0 or not self._connected:
+            return
+        new_val = [tuple(item) for item in self._pos[core.mask_elm(elm)]]
+        IrisAO_API.SetMirrorPosition(self._mirror, elm, new_val)
+        IrisAO_API.MirrorCommand(self._mirror, IrisAO_API.MirrorSendSettings)
+
     def _shape_save(self, name, arr, override):
+        """
+        Returns True if the shape was written
+        """
         if not self._connected:
             print("ERROR: Not connected to Mems")
-            return
+            return False
         if os.path.isfile(name) and not bool(override):
             print("File '{}' already exists".format(name))
-            return
-        np.savetxt(name, arr, header="TIP, TILT, PISTON")
+            return False
+        core.save_shape(name, arr)
+        core.index_filepath(name)
         print("Saved in '{}'".format(name))
+        return True
 
     def shape_save(self, name, override=False):
         """
@@ -270,7 +347,8 @@ class Mems(object):
 
     def shape_on_save(self, name, override=False):
         """
-        Saves the current shape ON into a file
+        Saves the current shape ON into a file, and returns its path,
+        or None if nothing was written
 
         Args:
           * name (str): the name of the file
@@ -278,8 +356,9 @@ class Mems(object):
             existing
         """
         name = core.make_filepath(name, core.SHAPEONFILENAME)
-        self._shape_save(name, self._pos, override)
+        saved = self._shape_save(name, self._pos, override)
         self.set_current_as_on()
+        return name if saved else None
 
     def set_current_as_on(self):
         """
@@ -312,11 +391,18 @@ class Mems(object):
         """
         print("\n".join(core.list_filepath(core.SHAPEFILENAME)))
 
-    def shape_on_list(self):
+    def shape_on_list(self, ret=False):
         """
         Shows all available shape ON files saved
+
+        Args:
+          * ret (bool): whether to print (if False) or return
+            the list
         """
-        print("\n".join(core.list_filepath(core.SHAPEONFILENAME)))
+        if not ret:
+            print("\n".join(core.list_filepath(core.SHAPEONFILENAME)))
+        else:
+            return core.list_filepath(core.SHAPEONFILENAME)
 
     def shape_off_list(self):
         """
@@ -327,6 +413,7 @@ class Mems(object):
     def _shape_delete(self, name):
         if os.path.isfile(name):
             os.remove(name)
+            core.unindex_filepath(name)
             print("Removed: '{}'".format(name))
         else:
             print("File '{}' not found".format(name))
@@ -366,9 +453,15 @@ class Mems(object):
             print("ERROR: Not connected to Mems")
             return None
         if os.path.isfile(name):
-            l = np.loadtxt(name)
+            pos, meta = core.load_shape(name)
+            if np.shape(pos) != (core.NSEGMENTS, 3):
+                print("File '{}' holds a shape of {} segments instead of {}".format(name,
+                        len(pos), core.NSEGMENTS))
+                return None
+            if meta.get('mirror', core.MIRRORNUM) != core.MIRRORNUM:
+                print("Warning: '{}' was saved for the mirror {}".format(name, meta['mirror']))
             print("Loaded '{}'".format(name))
-            return l
+            return pos.copy()
         else:
             print("File '{}' not found".format(name))
             return None
@@ -380,10 +473,10 @@ class Mems(object):
         Args:
           * name (str): the name of the file
         """
-        name = core.make_filepath_nostamp(name, core.SHAPEFILENAME)
+        name = core.make_filepath_nostamp(name, core.SHAPEFILENAME, latest=True)
         res = self._shape_load(name)
         if res is not None:
-            self._moveit(np.loadtxt(name), 'all')
+            self._moveit(res, 'all')
 
     def shape_on_load(self, name):
         """
@@ -392,10 +485,10 @@ class Mems(object):
         Args:
           * name (str): the name of the file
         """
-        name = core.make_filepath_nostamp(name, core.SHAPEONFILENAME)
+        name = core.make_filepath_nostamp(name, core.SHAPEONFILENAME, latest=True)
         res = self._shape_load(name)
         if res is not None:
-            self._on = np.loadtxt(name)
+            self._on = res
 
     def shape_off_load(self, name):
         """
@@ -404,343 +497,383 @@ class Mems(object):
         Args:
           * name (str): the name of the file
         """
-        name = core.make_filepath_nostamp(name, core.SHAPEOFFFILENAME)
+        name = core.make_filepath_nostamp(name, core.SHAPEOFFFILENAME, latest=True)
         res = self._shape_load(name)
         if res is not None:
-            self._off = np.loadtxt(name)
+            self._off = res
 
 
 
     def load_latest_shape(self):
-
-        l = self.shape_on_list(ret=True)
-        if len(l) > 0:
-            self.shape_on_load(l[-1])
+        """
+        Loads the latest shape ON saved, and returns its name, or None
+        """
+        latest = core.latest_filepath(core.SHAPEONFILENAME)
+        if latest is not None:
+            self.shape_on_load(latest)
+            return latest
         else:
             print("No latest shape saved")
+            return None
 
 
 
     def baseline1(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(19,0, 3, 3)
-        self.set_pos(16,0, 3, 3)
-        self.set_pos(29,0, 3, 3)
-        self.set_pos(17,0, 3, 3)
-        self.set_pos(20,0, 3, 3)
-        self.set_pos(33,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(19,0, 3, 3)
+            self.set_pos(16,0, 3, 3)
+            self.set_pos(29,0, 3, 3)
+            self.set_pos(17,0, 3, 3)
+            self.set_pos(20,0, 3, 3)
+            self.set_pos(33,0, 3, 3)
 
     def baseline2(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(19,0, 3, 3)
-        self.set_pos(16,0, 3, 3)
-        self.set_pos(29,0, 3, 3)
-        self.set_pos(17,0, 3, 3)
-        self.set_pos(20,0, 3, 3)
-        self.set_pos(24,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(19,0, 3, 3)
+            self.set_pos(16,0, 3, 3)
+            self.set_pos(29,0, 3, 3)
+            self.set_pos(17,0, 3, 3)
+            self.set_pos(20,0, 3, 3)
+            self.set_pos(24,0, 3, 3)
 
     def baseline3(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(19,0, 3, 3)
-        self.set_pos(16,0, 3, 3)
-        self.set_pos(29,0, 3, 3)
-        self.set_pos(17,0, 3, 3)
-        self.set_pos(33,0, 3, 3)
-        self.set_pos(24,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(19,0, 3, 3)
+            self.set_pos(16,0, 3, 3)
+            self.set_pos(29,0, 3, 3)
+            self.set_pos(17,0, 3, 3)
+            self.set_pos(33,0, 3, 3)
+            self.set_pos(24,0, 3, 3)
 
     def baseline4(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(19,0, 3, 3)
-        self.set_pos(16,0, 3, 3)
-        self.set_pos(29,0, 3, 3)
-        self.set_pos(20,0, 3, 3)
-        self.set_pos(33,0, 3, 3)
-        self.set_pos(24,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(19,0, 3, 3)
+            self.set_pos(16,0, 3, 3)
+            self.set_pos(29,0, 3, 3)
+            self.set_pos(20,0, 3, 3)
+            self.set_pos(33,0, 3, 3)
+            self.set_pos(24,0, 3, 3)
 
     def baseline5(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(19,0, 3, 3)
-        self.set_pos(16,0, 3, 3)
-        self.set_pos(17,0, 3, 3)
-        self.set_pos(20,0, 3, 3)
-        self.set_pos(33,0, 3, 3)
-        self.set_pos(24,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(19,0, 3, 3)
+            self.set_pos(16,0, 3, 3)
+            self.set_pos(17,0, 3, 3)
+            self.set_pos(20,0, 3, 3)
+            self.set_pos(33,0, 3, 3)
+            self.set_pos(24,0, 3, 3)
 
     def baseline6(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(19,0, 3, 3)
-        self.set_pos(29,0, 3, 3)
-        self.set_pos(17,0, 3, 3)
-        self.set_pos(20,0, 3, 3)
-        self.set_pos(33,0, 3, 3)
-        self.set_pos(24,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(19,0, 3, 3)
+            self.set_pos(29,0, 3, 3)
+            self.set_pos(17,0, 3, 3)
+            self.set_pos(20,0, 3, 3)
+            self.set_pos(33,0, 3, 3)
+            self.set_pos(24,0, 3, 3)
 
     def baseline7(self):
-        self.set_pos(15,0, 3, 3)
-        self.set_pos(16,0, 3, 3)
-        self.set_pos(29,0, 3, 3)
-        self.set_pos(17,0, 3, 3)
-        self.set_pos(20,0, 3, 3)
-        self.set_pos(33,0, 3, 3)
-        self.set_pos(24,0, 3, 3)
+        with self.batch():
+            self.set_pos(15,0, 3, 3)
+            self.set_pos(16,0, 3, 3)
+            self.set_pos(29,0, 3, 3)
+            self.set_pos(17,0, 3, 3)
+            self.set_pos(20,0, 3, 3)
+            self.set_pos(33,0, 3, 3)
+            self.set_pos(24,0, 3, 3)
 
     def baseline8(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
 
     def baseline9(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline10(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline11(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline12(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline13(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline14(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline15(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline16(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline17(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline18(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline19(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline20(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline21(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline22(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline23(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline24(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline25(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline26(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline27(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline28(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline29(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline30(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline31(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline32(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline33(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline34(self):
-        self.set_pos(15,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(15,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline35(self):
-        self.set_pos(19,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(19,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
 
     def baseline36(self):
-        self.set_pos(16,0, -3, -3)
-        self.set_pos(29,0, -3, -3)
-        self.set_pos(17,0, -3, -3)
-        self.set_pos(20,0, -3, -3)
-        self.set_pos(33,0, -3, -3)
-        self.set_pos(24,0, -3, -3)
-        self.set_pos(37,0, -3, -3)
+        with self.batch():
+            self.set_pos(16,0, -3, -3)
+            self.set_pos(29,0, -3, -3)
+            self.set_pos(17,0, -3, -3)
+            self.set_pos(20,0, -3, -3)
+            self.set_pos(33,0, -3, -3)
+            self.set_pos(24,0, -3, -3)
+            self.set_pos(37,0, -3, -3)
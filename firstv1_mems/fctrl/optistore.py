@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#
+#  FIRSTCTRL - Pupil remapping control software
+#  Copyright (C) 2016  Guillaume Schworer
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  For any information, bug report, idea, donation, hug, beer, please contact
+#    guillaume.schworer@gmail.com
+#
+###############################################################################
+
+
+import json
+
+from . import core
+np = core.np
+os = core.os
+datetime = core.datetime
+
+
+__all__ = ['OptiStore']
+
+
+# format of the dates in the index
+DATEFMT = '%Y%m%dT%H%M%S.%f'
+
+
+class OptiStore(object):
+    def __init__(self, path=core.PATHOPTI):
+        """
+        Append-only store of the optimization results
+
+        Each result is a compressed npz file holding the arrays of the
+        optimization, and a line of the index file holding its date,
+        mode, segments, best positions and fluxes and the shape file
+        produced. The queries only read the index; the npz files are
+        loaded on demand
+
+        Args:
+          * path (str): the directory of the store
+        """
+        self.path = path
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._index_name = os.path.join(self.path, core.OPTIINDEXNAME)
+        self._index = []
+        self._offset = 0
+
+    def _refresh(self):
+        """
+        Reads the entries appended to the index since the last read,
+        possibly by another process
+        """
+        if not os.path.isfile(self._index_name):
+            return
+        if os.path.getsize(self._index_name) == self._offset:
+            return
+        with open(self._index_name, 'r') as f:
+            f.seek(self._offset)
+            for line in f:
+                if line.strip():
+                    self._index.append(json.loads(line))
+            self._offset = f.tell()
+
+    def add(self, mode, segments, tip, tilt, flux, shape=None, **arrays):
+        """
+        Appends an optimization result to the store, and returns the
+        name of its npz file
+
+        Args:
+          * mode (str): the optimization mode
+          * segments (list of int): the segments optimized
+          * tip, tilt, flux (lists of float): the best positions and
+            fluxes of the segments
+          * shape (str or None): the shape file produced
+          * arrays: the arrays to save in the npz file, e.g. the grid
+            explored and the fluxes measured
+        """
+        now = datetime.utcnow()
+        name = now.strftime(core.OPTIFILENAME)
+        segments = [int(seg) for seg in segments]
+        np.savez_compressed(os.path.join(self.path, name),
+                            segments=segments, best_tip=tip, best_tilt=tilt,
+                            best_flux=flux, **arrays)
+        entry = {'name': name,
+                 'date': now.strftime(DATEFMT),
+                 'mode': str(mode),
+                 'segments': segments,
+                 'tip': [float(item) for item in tip],
+                 'tilt': [float(item) for item in tilt],
+                 'flux': [float(item) for item in flux],
+                 'shape': shape}
+        self._refresh()
+        with open(self._index_name, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            self._offset = f.tell()
+        self._index.append(entry)
+        return name
+
+    def find(self, since=None, until=None, segment=None, mode=None):
+        """
+        Returns the index entries of the results matching the query,
+        from the oldest to the most recent
+
+        Args:
+          * since (datetime, str or None): UTC date from which to search,
+            included, as datetime or 'YYYYmmdd[THHMMSS]'
+          * until (datetime, str or None): UTC date up to which to search,
+            excluded
+          * segment (int or None): a segment that was optimized
+          * mode (str or None): the optimization mode
+        """
+        self._refresh()
+        if isinstance(since, datetime):
+            since = since.strftime(DATEFMT)
+        if isinstance(until, datetime):
+            until = until.strftime(DATEFMT)
+        res = []
+        for entry in self._index:
+            if since is not None and entry['date'] < since:
+                continue
+            if until is not None and entry['date'] >= until:
+                continue
+            if segment is not None and int(segment) not in entry['segments']:
+                continue
+            if mode is not None and entry['mode'] != mode:
+                continue
+            res.append(entry)
+        return res
+
+    def latest(self, segment=None, mode=None):
+        """
+        Returns the index entry of the most recent result matching the
+        query, or None
+
+        Args:
+          * segment (int or None): a segment that was optimized
+          * mode (str or None): the optimization mode
+        """
+        res = self.find(segment=segment, mode=mode)
+        if len(res) == 0:
+            return None
+        return res[-1]
+
+    def best(self, segment):
+        """
+        Returns the (tip, tilt, flux, date) of the segment from its
+        most recent optimization, or None
+        """
+        entry = self.latest(segment=segment)
+        if entry is None:
+            return None
+        idx = entry['segments'].index(int(segment))
+        return entry['tip'][idx], entry['tilt'][idx], entry['flux'][idx], entry['date']
+
+    def load(self, entry):
+        """
+        Loads the arrays of a result, as a dict
+
+        Args:
+          * entry (dict or str): the index entry or the npz name
+        """
+        if isinstance(entry, dict):
+            entry = entry['name']
+        with np.load(os.path.join(self.path, entry)) as data:
+            return dict(data)
+
+    def list(self):
+        """
+        Shows all results of the store
+        """
+        for entry in self.find():
+            print("{date} {mode:>9s} segs: {segments} shape: {shape}".format(**entry))
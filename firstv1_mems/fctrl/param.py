@@ -39,6 +39,11 @@ NSEGMENTS = 37
 FIRSTSEGS = [15,19,16,29,17,20,33,24,37]
 #FIRSTSEGS = [15,29,16,33,17,24,20,33,37]
 
+# use a software simulation of the mems instead of IrisAO_PythonAPI
+MEMSSIMULATED = False
+MEMSSIMLATENCY = 0.  # time taken by each simulated driver access, in s
+MEMSSIMLOCKED = []  # segments simulated as locked
+
 TIPTILTMIN = -2  # in units given to the mems
 TIPTILTMAX = 2  # in units given to the mems
 PISTONMIN = -1  # in units given to the mems
@@ -56,7 +61,9 @@ MARGIN = 5  # px
 
 # lags to give time to camera and mems during the loop
 IMGLAG = 0.05  # lag to get the image from andor
-MEMSLAG = 0.05  # lag to move mems
+MEMSLAG = 0.05  # lag to move mems, until the segments settle
+FRAMETIMEOUT = 2.  # s, longest wait for a camera frame
+TRACKHISTORY = 3600  # number of injection tracking corrections kept
 
 # camera stuff
 CAMERACOOLING = True
@@ -89,6 +96,8 @@ SHAPEONFILENAME = '{name}_%Y%m%dT%H%M%S-%f.shapeon'
 SHAPEOFFFILENAME = '{name}_%Y%m%dT%H%M%S-%f.shapeoff'
 # the format of the name for the files that contain the coordinates of the boxes
 BOXESFILENAME = "{name}_%Y%m%dT%H%M%S-%f.boxes"
+# the name of the manifest that indexes the files of a directory
+LIBRARYFILENAME = ".library.json"
 
 
 # where to save the saved calibrations and boxes files
@@ -97,3 +106,12 @@ PATHIMG = ['andorsnaps']
 # the format of the name for the files that contain the coordinates of the boxes
 IMGFILENAME = "{name}_%Y%m%dT%H%M%S-%f.fits"
 
+
+# where to save the optimization results
+# relative to HOME
+PATHOPTI = ['.firstctrl', 'optimizations']
+# the format of the name for the files that contain an optimization result
+OPTIFILENAME = "opti_%Y%m%dT%H%M%S-%f.npz"
+# the name of the index of the optimization results
+OPTIINDEXNAME = "index.jsonl"
+
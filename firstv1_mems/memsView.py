@@ -33,7 +33,7 @@ import numpy as np
 from threading import Thread
 
 import memsCtrl as mCl
-from com_zmq import PColors
+from com_zmq import PColors, ComPortPUB, ComPortSUB
 from errorManaging import MyException
 
 
@@ -49,93 +49,27 @@ port_PUB = "tcp://*:5553"
 client_address = b"P"
 
 
-"""
-
-   Pubsub envelope subscriber
-
-   Author: Guillaume Aubert (gaubert) <guillaume(dot)aubert(at)gmail(dot)com>
-
-"""
-
-
-class ComPortSUB(Thread):
-    def __init__(self, publisher, port_SUB, address):
-        super().__init__()
-        self.running = True
-
-        self.pub = publisher
-        self.port = port_SUB
-        self.address = address
-
-        global m
-
-        self.start()
-
-    def _creation_socket(self):
-        self.context = zmq.Context()
-        self.sub = self.context.socket(zmq.SUB)
-        self.sub.connect(self.port)
-        self.sub.setsockopt(zmq.SUBSCRIBE, b'')
-        self.pub.pprint("Com receiver is initialized (address: %s)" % (self.port))
-
-    def run(self):
-        self._creation_socket()
-        while self.running:
-            cmd_dict = self.sub.recv_pyobj()
-            if cmd_dict["address"] == self.address:
-                cmd_dict.pop("address")
-                try:
-                    if cmd_dict["command"] == "done()":
-                        self.running = False
-                        done()
-                    else:
-                        command = getattr(m, cmd_dict["command"])
-                        cmd_dict.pop("command")
-                        command(**cmd_dict)
-                except Exception as cur_exception:
-                    self.pub.pprint(MyException(cur_exception))
-            else:
-                pass
-        #dself.stop()
-
-    def stop(self):
-        self.pub.pprint("Com receiver is closed (address: %s)" % (self.port))
-        self.sub.close()
-        self.context.term()
-
-    def start(self):
-        super().start()
+# Commands the remote clients can run on the mems
+MEMS_COMMANDS = ('connect', 'disconnect', 'flat', 'on', 'off', 'set_pos',
+                 'shape_save', 'shape_on_save', 'shape_off_save',
+                 'shape_list', 'shape_on_list', 'shape_off_list',
+                 'shape_delete', 'shape_on_delete', 'shape_off_delete',
+                 'shape_load', 'shape_on_load', 'shape_off_load',
+                 'piston_scan')
 
 
 ################################################################################
-##################              Publisher class             ####################
+##################           Function definition            ####################
 ################################################################################
 
 
-class ComPortPUB(object):
-    def __init__(self, port_PUB, client_address):
-        self.port = port_PUB
-        self.address = client_address
-
-        self.context = zmq.Context()
-        self.pub = self.context.socket(zmq.PUB)
-        self.pub.bind(self.port)
-        self.pprint("\n\nCom transmitter is initialized (address: %s)" % (self.port))
-
-    def pprint(self, message):
-        time.sleep(1)# need time to sleep before sending a message
-        self.pub.send_multipart([self.address, str(message).encode('UTF-8')])
-
-    def stop(self):
-        self.pprint("Com transmitter is closed (address: %s)" % (self.port))
-        self.pprint("done()")
-        self.pub.close()
-        self.context.term()
-
-
-################################################################################
-##################           Function definition            ####################
-################################################################################
+def command_table(mems):
+    """
+    Returns the dispatch table of the commands received by mems_sub
+    """
+    table = {name: getattr(mems, name) for name in MEMS_COMMANDS}
+    table['done'] = done
+    return table
 
 
 def done(comp_co=True):
@@ -159,18 +93,22 @@ if __name__ == "__main__":
 
 
     ### Initialize the communication receiver ###
-    mems_sub = ComPortSUB(mems_pub, port_SUB, server_address)
+    # the commands are available once the mems is initialised
+    commands = {}
+    mems_sub = ComPortSUB(mems_pub, port_SUB, server_address, commands)
 
 
     ###	Initialise Mems Live Viewer ###
     milk_solution = False
     if milk_solution:
         m = mCl.MemsCtrl(mems_pub, milk_solution)
+        commands.update(command_table(m))
     else:
         import memsDisplay as mDy
         Mems_Qt_app = mDy.QtWidgets.QApplication(sys.argv)
         app = mDy.MemsWindow(mems_pub)
         m = app.mems
+        commands.update(command_table(m))
         app.show()
         Mems_Qt_app.exec_()
 
@@ -0,0 +1,19 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the modules under test are imported from fctrl without running its
+# __init__, which needs the camera, the joystick and the display
+if 'fctrl' not in sys.modules:
+    fctrl = types.ModuleType('fctrl')
+    fctrl.__path__ = [os.path.join(ROOT, 'fctrl')]
+    sys.modules['fctrl'] = fctrl
+
+# fctrl.core imports the IrisAO driver, which needs its compiled library
+try:
+    import IrisAO_PythonAPI
+except ImportError:
+    sys.modules['IrisAO_PythonAPI'] = types.ModuleType('IrisAO_PythonAPI')
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+try:
+    # fctrl.core needs matplotlib, scipy and patiencebar
+    from fctrl import core
+except ImportError as e:
+    pytest.skip("fctrl cannot be imported: {}".format(e), allow_module_level=True)
+
+
+@pytest.mark.parametrize('n, order', [(1, 1), (2, 2), (3, 4), (9, 12), (19, 20),
+                                      (21, 24), (37, 40), (60, 60)])
+def test_hadamard(n, order):
+    h = core.hadamard(n)
+    assert h.shape == (order, order)
+    np.testing.assert_array_equal(np.dot(h.T, h), order * np.eye(order))
+    # mean pattern first, then zero-mean patterns
+    assert (h[:, 0] == 1).all()
+    np.testing.assert_array_equal(h[:, 1:].sum(axis=0), 0)
@@ -0,0 +1,109 @@
+import os
+import time
+
+import pytest
+
+try:
+    # fctrl.core needs matplotlib, scipy and patiencebar
+    from fctrl import library
+except ImportError as e:
+    pytest.skip("fctrl cannot be imported: {}".format(e), allow_module_level=True)
+
+
+def touch(path, *names):
+    for name in names:
+        with open(os.path.join(path, name), 'w') as f:
+            f.write('0')
+
+
+def test_split_stem():
+    assert library.split_stem('best_20200101T101010-000001') == ('best', '20200101T101010-000001')
+    assert library.split_stem('best_one') == ('best_one', '')
+    assert library.split_stem('best') == ('best', '')
+
+
+def test_add_latest_find(tmpdir):
+    path = str(tmpdir)
+    lib = library.FileLibrary(path)
+    names = ['best_20200101T000000-000000.shapeon',
+             'best_20200301T000000-000000.shapeon',
+             'other_20200201T000000-000000.shapeon',
+             'flat.shape']
+    for name in names:
+        touch(path, name)
+        lib.add(os.path.join(path, name))
+    assert lib.list('shapeon') == ['best_20200101T000000-000000',
+                                   'other_20200201T000000-000000',
+                                   'best_20200301T000000-000000']
+    assert lib.latest('shapeon') == 'best_20200301T000000-000000'
+    assert lib.latest('shapeon', 'other') == 'other_20200201T000000-000000'
+    assert lib.latest('shapeoff') is None
+    # full name, short name, unknown name
+    assert lib.find('shapeon', 'best_20200101T000000-000000') == 'best_20200101T000000-000000'
+    assert lib.find('shapeon', 'best') == 'best_20200301T000000-000000'
+    assert lib.find('shape', 'flat') == 'flat'
+    assert lib.find('shape', 'nope') is None
+    assert lib.between('shapeon', since='20200115', until='20200301') == ['other_20200201T000000-000000']
+
+
+def test_remove(tmpdir):
+    path = str(tmpdir)
+    lib = library.FileLibrary(path)
+    name = os.path.join(path, 'best_20200101T000000-000000.shapeon')
+    touch(path, os.path.basename(name))
+    lib.add(name)
+    os.remove(name)
+    lib.remove(name)
+    assert lib.list('shapeon') == []
+    assert lib.latest('shapeon', 'best') is None
+
+
+def test_manifest_reused(tmpdir):
+    path = str(tmpdir)
+    touch(path, 'a_20200101T000000-000000.shape', 'b.boxes')
+    assert library.FileLibrary(path).list('shape') == ['a_20200101T000000-000000']
+    assert os.path.isfile(os.path.join(path, library.core.LIBRARYFILENAME))
+    # a new library of the same directory reads the manifest
+    lib = library.FileLibrary(path)
+    assert lib.list('boxes') == ['b']
+
+
+def test_external_changes(tmpdir):
+    path = str(tmpdir)
+    lib = library.FileLibrary(path)
+    assert lib.list('shape') == []
+    # the directory mtime has a coarse resolution on some systems
+    time.sleep(0.01)
+    touch(path, 'new_20200101T000000-000000.shape')
+    os.utime(path, (time.time() + 1, time.time() + 1))
+    assert lib.latest('shape') == 'new_20200101T000000-000000'
+
+
+def test_external_file_before_save(tmpdir):
+    path = str(tmpdir)
+    lib = library.FileLibrary(path)
+    touch(path, 'old_20200101T000000-000000.shape')
+    lib.add(os.path.join(path, 'old_20200101T000000-000000.shape'))
+    manifest = os.path.join(path, library.core.LIBRARYFILENAME)
+    # copied by hand, after the manifest was written
+    touch(path, 'copied_20200201T000000-000000.shape')
+    os.utime(manifest, (time.time() - 10, time.time() - 10))
+    touch(path, 'saved_20200301T000000-000000.shape')
+    lib.add(os.path.join(path, 'saved_20200301T000000-000000.shape'))
+    assert lib.list('shape') == ['old_20200101T000000-000000',
+                                 'copied_20200201T000000-000000',
+                                 'saved_20200301T000000-000000']
+    assert lib.find('shape', 'copied') == 'copied_20200201T000000-000000'
+    # and the manifest written records it
+    assert library.FileLibrary(path).latest('shape', 'copied') == 'copied_20200201T000000-000000'
+
+
+def test_filepath_latest_only_if_asked(tmpdir):
+    path = str(tmpdir)
+    touch(path, 'best_20200101T000000-000000.shapeon')
+    fmt = library.core.SHAPEONFILENAME
+    # deleting needs the exact name
+    assert library.core.make_filepath_nostamp('best', fmt, basepath=path) == \
+        os.path.join(path, 'best.shapeon')
+    assert library.core.make_filepath_nostamp('best', fmt, basepath=path, latest=True) == \
+        os.path.join(path, 'best_20200101T000000-000000.shapeon')